@@ -1,17 +1,50 @@
-import requests
-import os
-import tempfile
-import wave
-import io
-from typing import Optional, Dict, Any
+import asyncio
+import hashlib
+import httpx
+import logging
+import re
+import struct
+from typing import Optional, Dict, Any, List
 from firebase.config import ELEVENLABS_API_KEY
 from firebase_service import FirebaseService
 
+logger = logging.getLogger(__name__)
+
+# Retry transient ElevenLabs/Firebase errors (these statuses, connection errors and timeouts)
+# with exponential backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.3
+
+# TTS audio is streamed into a buffer that reserves room for the WAV header up front
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+WAV_HEADER_SIZE = WAV_HEADER.size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# A joke is one TTS request, so its delivery and punchline timing stay intact. Only text longer
+# than TTS_SPLIT_MIN_CHARS is split, at sentence ends into parts of up to that many characters,
+# synthesized a few at a time
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+TTS_SPLIT_MIN_CHARS = 2500
+TTS_CONCURRENCY = 4
+
+# Stem of the last path segment of a voice URL (query string and extension excluded)
+URL_STEM_RE = re.compile(r'/([^/?#.]*)[^/?#]*(?:[?#]|$)')
+
 class ElevenlabsService:
     """
     Service class for interacting with ElevenLabs API for voice cloning and text-to-speech.
     """
     
+    # Shared across instances so concurrent requests multiplex over the same HTTP/2 connections
+    _client: Optional[httpx.AsyncClient] = None
+    _client_lock = asyncio.Lock()
+    
+    # sha256(firebase_voice_url) -> ElevenLabs voice_id, so a voice is only cloned once.
+    # A lock exists only while a lookup for that URL is in flight
+    _voice_id_cache: Dict[str, str] = {}
+    _voice_id_locks: Dict[str, asyncio.Lock] = {}
+    
     def __init__(self, api_key: Optional[str] = None):
         """
         Initialize the ElevenlabsService service.
@@ -28,7 +61,77 @@ class ElevenlabsService:
             "xi-api-key": self.api_key
         }
     
-    def _download_voice(self, firebase_voice_url: str) -> bytes:
+    @classmethod
+    async def _get_client(cls) -> httpx.AsyncClient:
+        """
+        Get the shared httpx client, creating it lazily on first use.
+        
+        Returns:
+            httpx.AsyncClient: The shared HTTP/2 client
+        """
+        if cls._client is None or cls._client.is_closed:
+            async with cls._client_lock:
+                if cls._client is None or cls._client.is_closed:
+                    # HTTP/2 lets download, clone and concurrent TTS calls share warm connections
+                    cls._client = httpx.AsyncClient(
+                        http2=True,
+                        timeout=httpx.Timeout(60.0),
+                        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+                    )
+        return cls._client
+    
+    @classmethod
+    async def aclose(cls):
+        """
+        Close the shared httpx client. Called on application shutdown.
+        """
+        if cls._client is not None and not cls._client.is_closed:
+            await cls._client.aclose()
+        cls._client = None
+    
+    async def _request(self, method: str, url: str, timeout: float, as_json: bool = False, buffer: Optional[bytearray] = None, retry_transport: bool = True, **kwargs):
+        """
+        Send a request on the shared client, retrying transient failures.
+        
+        Args:
+            method: HTTP method
+            url: Request URL
+            timeout: Total timeout in seconds
+            as_json: If True, return the decoded JSON body instead of raw bytes
+            buffer: Optional bytearray the response body is streamed into chunk by chunk
+            retry_transport: If False, connection errors and timeouts are raised at once;
+                set for non-idempotent calls, which the server may have applied already
+            **kwargs: Extra arguments passed to client.stream
+        
+        Returns:
+            The response body as bytes, the decoded JSON if as_json is True, or buffer if given
+        """
+        client = await self._get_client()
+        start = len(buffer) if buffer is not None else 0
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with client.stream(method, url, timeout=timeout, **kwargs) as response:
+                    if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+                        await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+                        continue
+                    response.raise_for_status()
+                    if buffer is not None:
+                        async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                            buffer.extend(chunk)
+                        return buffer
+                    await response.aread()
+                    return response.json() if as_json else response.content
+            except httpx.TransportError as e:
+                # Connection resets and timeouts are retried like transient statuses
+                if not retry_transport or attempt >= MAX_RETRIES:
+                    raise
+                logger.warning("Retrying %s %s after transport error: %s", method, url, e)
+                if buffer is not None:
+                    # Drop a partially streamed body so the retry doesn't append it twice
+                    del buffer[start:]
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+    
+    async def _download_voice(self, firebase_voice_url: str) -> bytes:
         """
         Download voice file from Firebase URL.
         
@@ -42,16 +145,15 @@ class ElevenlabsService:
             Exception: If download fails
         """
         try:
-            print(f"[ElevenLabs] Downloading voice from: {firebase_voice_url}")
-            response = requests.get(firebase_voice_url, timeout=30)
-            response.raise_for_status()
-            print(f"[ElevenLabs] Successfully downloaded voice file ({len(response.content)} bytes)")
-            return response.content
+            logger.info("Downloading voice from: %s", firebase_voice_url)
+            voice_data = await self._request("GET", firebase_voice_url, timeout=30)
+            logger.info("Successfully downloaded voice file (%d bytes)", len(voice_data))
+            return voice_data
         except Exception as e:
-            print(f"[ElevenLabs] Error downloading voice: {str(e)}")
+            logger.error("Error downloading voice: %s", e)
             raise
     
-    def _clone_voice(self, voice_data: bytes, voice_name: str = "cloned_voice") -> str:
+    async def _clone_voice(self, voice_data: bytes, voice_name: str = "cloned_voice") -> str:
         """
         Clone a voice using ElevenLabs API.
         
@@ -66,62 +168,84 @@ class ElevenlabsService:
             Exception: If voice cloning fails
         """
         try:
-            print(f"[ElevenLabs] Cloning voice with name: {voice_name}")
+            logger.info("Cloning voice with name: %s", voice_name)
             
-            # Create a temporary file to upload
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_file:
-                temp_file.write(voice_data)
-                temp_file_path = temp_file.name
+            url = f"{self.base_url}/voices/add"
+            
+            # ElevenLabs API expects files as a list in multipart form data
+            files = [('files', (f'{voice_name}.mp3', voice_data, 'audio/mpeg'))]
+            data = {
+                'name': voice_name,
+                'description': f'Cloned voice from Firebase: {voice_name}'
+            }
+            
+            result = await self._request(
+                "POST",
+                url,
+                timeout=60,
+                as_json=True,
+                retry_transport=False,  # a timed-out clone may have been created; don't clone twice
+                files=files,
+                data=data,
+                headers=self.headers
+            )
+            
+            voice_id = result.get('voice_id')
+            
+            if not voice_id:
+                raise ValueError("Voice cloning succeeded but no voice_id returned")
+            
+            logger.info("Successfully cloned voice. Voice ID: %s", voice_id)
+            return voice_id
             
-            try:
-                # Prepare the request for voice cloning
-                url = f"{self.base_url}/voices/add"
-                
-                # Read the file content first
-                with open(temp_file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # ElevenLabs API expects files as a list in multipart form data
-                with open(temp_file_path, 'rb') as voice_file:
-                    files = {
-                        'files': (f'{voice_name}.mp3', voice_file, 'audio/mpeg')
-                    }
-                    
-                    data = {
-                        'name': voice_name,
-                        'description': f'Cloned voice from Firebase: {voice_name}'
-                    }
-                    
-                    response = requests.post(
-                        url,
-                        headers=self.headers,
-                        files=files,
-                        data=data,
-                        timeout=60
-                    )
-                    response.raise_for_status()
-                    
-                    result = response.json()
-                    voice_id = result.get('voice_id')
-                    
-                    if not voice_id:
-                        raise ValueError("Voice cloning succeeded but no voice_id returned")
-                    
-                    print(f"[ElevenLabs] Successfully cloned voice. Voice ID: {voice_id}")
-                    return voice_id
-                
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
-                    
         except Exception as e:
-            print(f"[ElevenLabs] Error cloning voice: {str(e)}")
+            logger.error("Error cloning voice: %s", e)
             raise
     
-    def _generate_audio(self, text: str, voice_id: str) -> bytes:
+    async def _stream_pcm(self, text: str, voice_id: str, buffer: bytearray) -> bytearray:
+        """
+        Stream raw 24kHz PCM for text from the ElevenLabs TTS endpoint into a buffer.
+        
+        Args:
+            text: The text to convert to speech
+            voice_id: The ElevenLabs voice ID to use
+            buffer: Buffer the PCM data is appended to
+        
+        Returns:
+            bytearray: The same buffer, with the PCM data appended
+        """
+        url = f"{self.base_url}/text-to-speech/{voice_id}"
+        
+        payload = {
+            "text": text,
+            "model_id": "eleven_multilingual_v2",
+            "voice_settings": {
+                "stability": 0.5,
+                "similarity_boost": 0.75
+            }
+        }
+        
+        # Raw 16-bit PCM at 24kHz, no container: sentence parts concatenate cleanly and
+        # _generate_audio writes the single WAV header for the joined audio
+        params = {
+            "output_format": "pcm_24000"
+        }
+        
+        return await self._request(
+            "POST",
+            url,
+            timeout=60,
+            buffer=buffer,
+            headers=self.headers,
+            json=payload,
+            params=params
+        )
+    
+    async def _generate_audio(self, text: str, voice_id: str) -> bytes:
         """
         Generate audio from text using the cloned voice.
+        Text longer than TTS_SPLIT_MIN_CHARS is synthesized in sentence-aligned parts
+        concurrently and joined in order; anything shorter is a single request.
         
         Args:
             text: The text to convert to speech
@@ -134,81 +258,140 @@ class ElevenlabsService:
             Exception: If audio generation fails
         """
         try:
-            print(f"[ElevenLabs] Generating audio for text (length: {len(text)}) with voice_id: {voice_id}")
+            logger.info("Generating audio for text (length: %d) with voice_id: %s", len(text), voice_id)
             
-            url = f"{self.base_url}/text-to-speech/{voice_id}"
+            text_parts = self._split_text(text)
             
-            payload = {
-                "text": text,
-                "model_id": "eleven_multilingual_v2",
-                "voice_settings": {
-                    "stability": 0.5,
-                    "similarity_boost": 0.75
-                }
-            }
-            
-            # Request WAV format explicitly
-            params = {
-                "output_format": "pcm_24000"  # WAV format with 24kHz sample rate
-            }
-            
-            response = requests.post(
-                url,
-                headers={**self.headers, "Content-Type": "application/json"},
-                json=payload,
-                params=params,
-                timeout=60
-            )
-            response.raise_for_status()
-            
-            # Get audio data
-            audio_data = response.content
+            # Stream the raw PCM in chunks straight after a reserved WAV header slot,
+            # instead of reading the whole body and copying it again to prepend a header
+            buffer = bytearray(WAV_HEADER_SIZE)
+            if len(text_parts) <= 1:
+                await self._stream_pcm(text, voice_id, buffer)
+            else:
+                semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+                
+                async def generate_part(text_part: str) -> bytearray:
+                    async with semaphore:
+                        return await self._stream_pcm(text_part, voice_id, bytearray())
+                
+                # Raw PCM at a fixed sample rate concatenates cleanly; gather keeps the parts in order
+                parts = await asyncio.gather(*(generate_part(p) for p in text_parts))
+                for part in parts:
+                    buffer.extend(part)
             
-            # Convert PCM to WAV format if needed
-            # The response might be raw PCM, so we'll wrap it in WAV format
-            audio_data = self._convert_pcm_to_wav(audio_data)
+            # Fill in the WAV header for the PCM data
+            self._write_wav_header(buffer, len(buffer) - WAV_HEADER_SIZE)
+            audio_data = bytes(buffer)
             
-            print(f"[ElevenLabs] Successfully generated audio ({len(audio_data)} bytes)")
+            logger.info("Successfully generated audio (%d bytes, %d request(s))", len(audio_data), len(text_parts))
             return audio_data
             
         except Exception as e:
-            print(f"[ElevenLabs] Error generating audio: {str(e)}")
+            logger.error("Error generating audio: %s", e)
             raise
     
-    def _convert_pcm_to_wav(self, pcm_data: bytes, sample_rate: int = 24000, channels: int = 1, sample_width: int = 2) -> bytes:
+    def _split_text(self, text: str) -> List[str]:
+        """
+        Split text for TTS: a single part up to TTS_SPLIT_MIN_CHARS, otherwise whole
+        sentences packed into parts of at most TTS_SPLIT_MIN_CHARS characters.
+        
+        Args:
+            text: The text to convert to speech
+        
+        Returns:
+            List[str]: The text parts, in order
+        """
+        text = text.strip()
+        if len(text) <= TTS_SPLIT_MIN_CHARS:
+            return [text]
+        
+        parts = []
+        current = ""
+        for sentence in SENTENCE_SPLIT_RE.split(text):
+            if not sentence:
+                continue
+            if current and len(current) + 1 + len(sentence) > TTS_SPLIT_MIN_CHARS:
+                parts.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            parts.append(current)
+        return parts
+    
+    def _write_wav_header(self, buffer: bytearray, data_size: int, sample_rate: int = 24000, channels: int = 1, sample_width: int = 2):
         """
-        Convert PCM audio data to WAV format.
+        Write a WAV header into the first 44 bytes of a buffer holding PCM audio data.
         
         Args:
-            pcm_data: Raw PCM audio data
+            buffer: Buffer with WAV_HEADER_SIZE reserved bytes followed by raw PCM data
+            data_size: Size of the PCM data in bytes
             sample_rate: Sample rate in Hz (default: 24000)
             channels: Number of audio channels (default: 1 for mono)
             sample_width: Sample width in bytes (default: 2 for 16-bit)
+        """
+        byte_rate = sample_rate * channels * sample_width
+        block_align = channels * sample_width
+        WAV_HEADER.pack_into(
+            buffer, 0,
+            b'RIFF', 36 + data_size, b'WAVE',
+            b'fmt ', 16, 1, channels, sample_rate, byte_rate, block_align, sample_width * 8,
+            b'data', data_size
+        )
+    
+    async def _get_voice_id(self, firebase_voice_url: str) -> str:
+        """
+        Get the ElevenLabs voice_id for a Firebase voice, cloning it only on a cache miss.
+        Checks the in-memory cache first, then the voice_cache collection in Firestore.
+        
+        Args:
+            firebase_voice_url: URL of the voice file in Firebase Storage
         
         Returns:
-            bytes: WAV formatted audio data
+            str: The ElevenLabs voice_id
         """
+        cache_key = hashlib.sha256(firebase_voice_url.encode()).hexdigest()
+        voice_id = self._voice_id_cache.get(cache_key)
+        if voice_id:
+            return voice_id
+        
+        # One clone per URL even when several requests miss the cache at once
+        lock = self._voice_id_locks.setdefault(cache_key, asyncio.Lock())
         try:
-            # Create WAV file in memory
-            wav_buffer = io.BytesIO()
-            
-            with wave.open(wav_buffer, 'wb') as wav_file:
-                wav_file.setnchannels(channels)
-                wav_file.setsampwidth(sample_width)
-                wav_file.setframerate(sample_rate)
-                wav_file.writeframes(pcm_data)
+            async with lock:
+                voice_id = self._voice_id_cache.get(cache_key)
+                if voice_id:
+                    return voice_id
             
-            wav_buffer.seek(0)
-            return wav_buffer.read()
+                voice_id = await asyncio.to_thread(FirebaseService.get_cached_elevenlabs_voice_id, cache_key)
+                if not voice_id:
+                    # Download the voice
+                    voice_data = await self._download_voice(firebase_voice_url)
+                
+                    # Clone the voice and get voice_id
+                    # Extract a name from the URL or use a default
+                    match = URL_STEM_RE.search(firebase_voice_url)
+                    voice_name = (match and match.group(1)) or "cloned_voice"
+                    voice_id = await self._clone_voice(voice_data, voice_name)
+                
+                    await asyncio.to_thread(
+                        FirebaseService.save_cached_elevenlabs_voice_id, cache_key, voice_id, firebase_voice_url
+                    )
+                else:
+                    logger.info("Using cached voice ID: %s", voice_id)
             
-        except Exception as e:
-            print(f"[ElevenLabs] Error converting PCM to WAV: {str(e)}")
-            # If conversion fails, return original data
-            return pcm_data
+                self._voice_id_cache[cache_key] = voice_id
+                return voice_id
+        finally:
+            # Drop the lock once the lookup is done, so the dict doesn't grow with every URL seen.
+            # Waiters already hold the lock object, and later calls hit _voice_id_cache first
+            if self._voice_id_locks.get(cache_key) is lock:
+                del self._voice_id_locks[cache_key]
     
-    def read_joke_with_the_voice(self, firebase_voice_url: str, joke_text: str, joke_id: str) -> Dict[str, Any]:
+    async def read_joke_with_the_voice(self, firebase_voice_url: str, joke_text: str, joke_id: str) -> Dict[str, Any]:
         """
         Download voice, clone it, generate audio for the joke text, and save to Firebase bucket.
+        The voice is only downloaded and cloned the first time a voice URL is seen.
         
         Args:
             firebase_voice_url: URL of the voice file in Firebase Storage
@@ -222,22 +405,19 @@ class ElevenlabsService:
             Exception: If any step fails
         """
         try:
-            # Step 1: Download the voice
-            voice_data = self._download_voice(firebase_voice_url)
-            
-            # Step 2: Clone the voice and get voice_id
-            # Extract a name from the URL or use a default
-            voice_name = os.path.basename(firebase_voice_url).split('.')[0] or "cloned_voice"
-            voice_id = self._clone_voice(voice_data, voice_name)
+            # Step 1-2: Download and clone the voice (cached per voice URL)
+            voice_id = await self._get_voice_id(firebase_voice_url)
             
             # Step 3: Generate audio with the cloned voice (already in WAV format)
-            wav_audio = self._generate_audio(joke_text, voice_id)
+            wav_audio = await self._generate_audio(joke_text, voice_id)
             
-            # Step 4: Save to Firebase bucket
+            # Step 4: Save to Firebase bucket (blocking upload runs off the event loop)
             file_path = f"jokes_audio/{joke_id}/voice_{voice_id}.wav"
-            audio_url, audio_size = FirebaseService.save_to_bucket(file_path, wav_audio, content_type='audio/wav')
+            audio_url, audio_size = await asyncio.to_thread(
+                FirebaseService.save_to_bucket, file_path, wav_audio, content_type='audio/wav'
+            )
             
-            print(f"[ElevenLabs] Successfully saved audio to bucket: {audio_url} (size: {audio_size} bytes)")
+            logger.info("Successfully saved audio to bucket: %s (size: %d bytes)", audio_url, audio_size)
             
             return {
                 "audio_url": audio_url,
@@ -246,6 +426,6 @@ class ElevenlabsService:
             }
             
         except Exception as e:
-            print(f"[ElevenLabs] Error in read_joke_with_the_voice: {str(e)}")
+            logger.error("Error in read_joke_with_the_voice: %s", e)
             raise
 
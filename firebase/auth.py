@@ -2,16 +2,45 @@ from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from firebase_admin import auth
 from typing import Optional
+from cachetools import TLRUCache
+import hashlib
+import threading
+import time
 
 security = HTTPBearer()
 
+# Decoded ID tokens are cached for up to 5 minutes (never past the token's own expiry)
+TOKEN_CACHE_TTL = 300
+
+def _token_ttu(_key, decoded_token, now):
+    return min(now + TOKEN_CACHE_TTL, decoded_token.get('exp', now))
+
+_token_cache = TLRUCache(maxsize=10_000, ttu=_token_ttu, timer=time.time)
+_token_cache_lock = threading.Lock()
+
+def verify_id_token_cached(token: str) -> dict:
+    """
+    Verify a Firebase ID token, reusing the decoded token for repeat requests
+    """
+    # Key on a digest so raw tokens are not kept in memory
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    with _token_cache_lock:
+        decoded_token = _token_cache.get(key)
+    if decoded_token is not None:
+        return decoded_token
+    
+    decoded_token = auth.verify_id_token(token)
+    with _token_cache_lock:
+        _token_cache[key] = decoded_token
+    return decoded_token
+
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """
     Verify Firebase ID token and return user_id
     """
     try:
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = verify_id_token_cached(token)
         user_id = decoded_token.get('uid')
         
         if not user_id:
@@ -44,7 +73,7 @@ async def get_optional_user_id(
     
     try:
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = verify_id_token_cached(token)
         user_id = decoded_token.get('uid')
         return user_id if user_id else None
     except Exception:
@@ -1,8 +1,13 @@
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials, firestore, firestore_async, storage
 import os
 from .config import FIREBASE_CREDENTIALS_PATH, FIREBASE_STORAGE_BUCKET
 
+# Cached client handles, created once after the app is initialized
+_db = None
+_async_db = None
+_bucket = None
+
 # Initialize Firebase Admin SDK
 def initialize_firebase():
     if not firebase_admin._apps:
@@ -16,14 +21,26 @@ def initialize_firebase():
             # Make sure to set GOOGLE_APPLICATION_CREDENTIALS environment variable
             firebase_admin.initialize_app()
     
-    return firestore.client(), storage.bucket()
+    return get_firestore(), get_storage_bucket()
 
 
 # Get Firestore client
 def get_firestore():
-    return firestore.client()
+    global _db
+    if _db is None:
+        _db = firestore.client()
+    return _db
+
+# Get async Firestore client (for use from async route handlers)
+def get_async_firestore():
+    global _async_db
+    if _async_db is None:
+        _async_db = firestore_async.client()
+    return _async_db
 
 # Get Storage bucket
 def get_storage_bucket():
-    return storage.bucket()
-
+    global _bucket
+    if _bucket is None:
+        _bucket = storage.bucket()
+    return _bucket
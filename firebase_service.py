@@ -1,15 +1,295 @@
-from firebase.firebase_init import get_firestore, get_storage_bucket
+from firebase.firebase_init import get_firestore, get_async_firestore, get_storage_bucket
 from models import JokeResponse
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict, Tuple
 from datetime import datetime
-from firebase_admin.firestore import ArrayUnion
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from firebase_admin.firestore import ArrayUnion, ArrayRemove, Increment, SERVER_TIMESTAMP, transactional
+from google.api_core.exceptions import AlreadyExists
+from google.api_core.retry import Retry, if_transient_error
+from cachetools import TTLCache
+import asyncio
+import atexit
+import functools
+import hashlib
+import logging
+import queue
 import random
 import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Fields read when converting a joke document to a JokeResponse (including legacy names)
+JOKE_FIELDS = [
+    'joke_setup', 'joke_punchline', 'joke_content',
+    'default_audio_url', 'default_audio_id', 'audio_urls', 'audio_ids',
+    'scenarios', 'age_range', 'ages', 'emoji',
+    'created_by_customer', 'creator_id', 'created_at', 'random_val'
+]
+
+# Batched reads: refs per get_all call, and how many chunks are fetched at once.
+# Chunks are fetched on one shared pool so concurrent requests can't exhaust the gRPC channel
+GET_ALL_CHUNK_SIZE = 300
+GET_ALL_MAX_WORKERS = 8
+_read_executor = ThreadPoolExecutor(max_workers=GET_ALL_MAX_WORKERS, thread_name_prefix="firestore-read")
+
+# Bulk joke ingestion: ops per WriteBatch (Firestore allows 500), concurrent commits,
+# and retry of transient Firestore errors per commit
+SAVE_JOKES_BATCH_SIZE = 500
+SAVE_JOKES_MAX_WORKERS = 20
+WRITE_RETRY = Retry(predicate=if_transient_error)
+
+# Firestore caps the number of values in an 'in' filter
+IN_QUERY_CHUNK_SIZE = 30
+
+# get_random_jokes filters on one array field of lowercase keys, since a query allows a single
+# array_contains_any: 's:<scenario>', 'a:<age range>' and 's:<scenario>|a:<age range>'.
+# A joke with no scenarios (or age ranges) matches any, stored as FILTER_KEY_ANY
+FILTER_KEYS_FIELD = 'filter_keys'
+FILTER_KEY_ANY = '*'
+
+# Short-lived cache of get_all_jokes pages: (limit, start_after) -> (jokes, next_cursor)
+JOKES_CACHE_TTL = 30
+JOKES_CACHE_MAX_PAGES = 256
+_jokes_cache = TTLCache(maxsize=JOKES_CACHE_MAX_PAGES, ttl=JOKES_CACHE_TTL, timer=time.monotonic)
+_jokes_cache_lock = threading.Lock()
+
+# Short-lived cache of single jokes read by ID: joke_id -> JokeResponse
+JOKE_CACHE_TTL = 300
+JOKE_CACHE_MAX_JOKES = 10_000
+_joke_cache = TTLCache(maxsize=JOKE_CACHE_MAX_JOKES, ttl=JOKE_CACHE_TTL, timer=time.monotonic)
+_joke_cache_lock = threading.Lock()
+
+# Short-lived cache of per-user joke lists: (user list field, user_id) -> jokes
+USER_JOKES_CACHE_TTL = 30
+_user_jokes_cache = TTLCache(maxsize=1024, ttl=USER_JOKES_CACHE_TTL, timer=time.monotonic)
+_user_jokes_cache_lock = threading.Lock()
+
+# Short-lived cache of get_user_joke_ids results: user_id -> joke ID lists
+USER_JOKE_IDS_CACHE_MAX_USERS = 10_000
+_user_joke_ids_cache = TTLCache(maxsize=USER_JOKE_IDS_CACHE_MAX_USERS, ttl=USER_JOKES_CACHE_TTL, timer=time.monotonic)
+_user_joke_ids_cache_lock = threading.Lock()
+
+# joke_metadata counters are sharded across joke_metadata/{joke_id}/shards/{0..N-1} so writes to a
+# popular joke are spread over several documents; readers sum the shards
+METADATA_COUNTER_FIELDS = ('liked_times', 'disliked_times', 'saved_to_favorite_times')
+METADATA_SHARDS = 10
+
+# joke_metadata counter bumps are summed in memory per (joke_id, field) and written by a
+# background thread every METADATA_FLUSH_INTERVAL seconds, one merged Increment per joke
+METADATA_FLUSH_INTERVAL = 2.0
+_pending_counters: Dict[Tuple[str, str], int] = defaultdict(int)
+_pending_counters_lock = threading.Lock()
+_counter_flusher: Optional[threading.Thread] = None
+_counter_flusher_lock = threading.Lock()
+
+# Fire-and-forget writes are queued and committed together by a background thread:
+# up to WRITE_BATCH_MAX_OPS ops gathered within WRITE_BATCH_WINDOW seconds share one WriteBatch
+WRITE_BATCH_MAX_OPS = 400
+WRITE_BATCH_WINDOW = 0.05
+_write_queue: "queue.Queue" = queue.Queue()
+_write_flusher: Optional[threading.Thread] = None
+_write_flusher_lock = threading.Lock()
 
 def _get_db():
     """Lazy initialization of Firestore client"""
     return get_firestore()
 
+@functools.cache
+def _jokes_ref():
+    """Cached reference to the jokes collection"""
+    return _get_db().collection('jokes')
+
+@functools.cache
+def _users_ref():
+    """Cached reference to the users collection"""
+    return _get_db().collection('users')
+
+@functools.cache
+def _joke_metadata_ref():
+    """Cached reference to the joke_metadata collection"""
+    return _get_db().collection('joke_metadata')
+
+@functools.cache
+def _joke_audios_ref():
+    """Cached reference to the joke_audios collection"""
+    return _get_db().collection('joke_audios')
+
+@functools.cache
+def _voices_ref():
+    """Cached reference to the voices collection"""
+    return _get_db().collection('voices')
+
+@functools.cache
+def _voice_cache_ref():
+    """Cached reference to the voice_cache collection"""
+    return _get_db().collection('voice_cache')
+
+def _get_async_db():
+    """Lazy initialization of async Firestore client"""
+    return get_async_firestore()
+
+def _new_user_doc(**fields) -> Dict:
+    """Default document for a user created implicitly by their first write; fields override the defaults"""
+    user_data = {
+        'user_display_name': '',
+        'user_email': '',
+        'country': '',
+        'favorites': [],
+        'like_history': [],
+        'dislike_history': [],
+        'creation_history': [],
+        'joke_jar': [],
+        'voices': [],
+        'settings': {},
+        'age_range': '',
+        'scenario': '',
+        'voice_to_use': '',
+        'created_at': SERVER_TIMESTAMP
+    }
+    user_data.update(fields)
+    return user_data
+
+def _filter_keys(scenarios: Optional[List[str]], age_range: Optional[List[str]]) -> List[str]:
+    """Keys get_random_jokes matches a joke with these scenarios and age ranges on"""
+    scenario_values = sorted({v.strip().lower() for v in scenarios or [] if v and v.strip()}) or [FILTER_KEY_ANY]
+    age_values = sorted({v.strip().lower() for v in age_range or [] if v and v.strip()}) or [FILTER_KEY_ANY]
+    keys = [f"s:{s}" for s in scenario_values] + [f"a:{a}" for a in age_values]
+    keys += [f"s:{s}|a:{a}" for s in scenario_values for a in age_values]
+    return keys
+
+def _enqueue_write(doc_ref, data: Dict, mode: str = 'update', on_commit: Optional[Callable[[], None]] = None):
+    """
+    Queue a batch write ('set' or 'update') of data to doc_ref, starting the flusher on first use.
+    on_commit, if given, is called once the batch holding the write has been committed.
+    """
+    global _write_flusher
+    if _write_flusher is None:
+        with _write_flusher_lock:
+            if _write_flusher is None:
+                _write_flusher = threading.Thread(target=_flush_writes, name="firestore-write-flusher", daemon=True)
+                _write_flusher.start()
+    _write_queue.put((doc_ref, data, mode, on_commit))
+
+def _flush_writes():
+    """Background loop committing queued writes in batches"""
+    while True:
+        ops = [_write_queue.get()]
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW
+        while len(ops) < WRITE_BATCH_MAX_OPS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                ops.append(_write_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            _commit_queued_writes(ops)
+        finally:
+            for _ in ops:
+                _write_queue.task_done()
+
+def _commit_queued_writes(ops: list):
+    """
+    Commit queued writes in one batch, retrying transient errors. If the batch still fails,
+    each write is committed on its own, so one bad write can't drop the others.
+    on_commit callbacks run only for writes that were committed.
+    """
+    committed = []
+    try:
+        batch = _get_db().batch()
+        for doc_ref, data, mode, _ in ops:
+            getattr(batch, mode)(doc_ref, data)
+        batch.commit(retry=WRITE_RETRY)
+        committed = ops
+    except Exception:
+        logger.exception("Error committing %d queued writes in one batch, committing them one by one", len(ops))
+        for op in ops:
+            doc_ref, data, mode, _ = op
+            try:
+                getattr(doc_ref, mode)(data, retry=WRITE_RETRY)
+                committed.append(op)
+            except Exception:
+                logger.exception("Dropping queued %s of %s after retries failed", mode, doc_ref.path)
+    
+    for _, _, _, on_commit in committed:
+        if on_commit:
+            try:
+                on_commit()
+            except Exception:
+                logger.exception("Error in on_commit callback of a queued write")
+
+def _metadata_shard_ref(joke_id: str):
+    """A random counter shard of the joke's joke_metadata document"""
+    return _joke_metadata_ref().document(joke_id).collection('shards').document(str(random.randrange(METADATA_SHARDS)))
+
+def _add_pending_counter(joke_id: str, field: str, increment: int):
+    """Add a counter delta to be written on the next flush, starting the flusher on first use"""
+    global _counter_flusher
+    if _counter_flusher is None:
+        with _counter_flusher_lock:
+            if _counter_flusher is None:
+                _counter_flusher = threading.Thread(target=_flush_counters_loop, name="joke-metadata-flusher", daemon=True)
+                _counter_flusher.start()
+    with _pending_counters_lock:
+        _pending_counters[(joke_id, field)] += increment
+
+def _flush_counters():
+    """Write all pending counter deltas, one merged Increment set per joke_metadata document"""
+    with _pending_counters_lock:
+        pending = dict(_pending_counters)
+        _pending_counters.clear()
+
+    increments_by_joke: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for (joke_id, field), delta in pending.items():
+        if delta:
+            increments_by_joke[joke_id][field] = delta
+    if not increments_by_joke:
+        return
+
+    db = _get_db()
+    items = list(increments_by_joke.items())
+    for i in range(0, len(items), WRITE_BATCH_MAX_OPS):
+        chunk = items[i:i + WRITE_BATCH_MAX_OPS]
+        try:
+            batch = db.batch()
+            for joke_id, increments in chunk:
+                batch.set(_metadata_shard_ref(joke_id), {field: Increment(delta) for field, delta in increments.items()}, merge=True)
+            batch.commit(retry=WRITE_RETRY)
+        except Exception as e:
+            print(f"Error updating joke_metadata counters for {len(chunk)} jokes: {str(e)}")
+
+def _flush_counters_loop():
+    """Background loop flushing pending counter deltas"""
+    while True:
+        time.sleep(METADATA_FLUSH_INTERVAL)
+        _flush_counters()
+
+# Don't lose counter deltas buffered at exit
+atexit.register(_flush_counters)
+
+def _invalidate_jokes_cache():
+    """Drop cached get_all_jokes pages after the jokes collection changes"""
+    with _jokes_cache_lock:
+        _jokes_cache.clear()
+
+def _invalidate_joke_cache(*joke_ids: str):
+    """Drop cached get_joke_by_id results for jokes that changed"""
+    with _joke_cache_lock:
+        for joke_id in joke_ids:
+            _joke_cache.pop(joke_id, None)
+
+def _invalidate_user_jokes_cache(user_id: str, *fields: str):
+    """Drop a user's cached joke lists for the given user list fields, and their cached joke IDs, after they change"""
+    with _user_jokes_cache_lock:
+        for field in fields:
+            _user_jokes_cache.pop((field, user_id), None)
+    with _user_joke_ids_cache_lock:
+        _user_joke_ids_cache.pop(user_id, None)
+
 class FirebaseService:
     
     @staticmethod
@@ -41,6 +321,92 @@ class FirebaseService:
         
         return normalized
     
+    @staticmethod
+    def _doc_to_joke(doc) -> JokeResponse:
+        """Convert a joke document snapshot to a JokeResponse, accepting legacy field names"""
+        get = doc.to_dict().get
+        # Convert Firestore timestamp to datetime if needed
+        created_at = get('created_at')
+        if hasattr(created_at, 'timestamp'):
+            created_at = datetime.fromtimestamp(created_at.timestamp())
+
+        return JokeResponse(
+            joke_id=doc.id,
+            joke_setup=get('joke_setup', ''),
+            joke_punchline=get('joke_punchline', ''),
+            joke_content=get('joke_content', ''),
+            default_audio_url=get('default_audio_url') or get('default_audio_id', ''),  # Support old field name for backward compatibility
+            audio_urls=FirebaseService._normalize_audio_urls(get('audio_urls') or get('audio_ids')),  # Support old field name for backward compatibility
+            scenarios=get('scenarios', []),
+            age_range=get('age_range') or get('ages', []),  # Support both old and new field names
+            emoji=get('emoji', ''),
+            created_by_customer=get('created_by_customer', False),
+            creator_id=get('creator_id', ''),
+            created_at=created_at,
+            random_val=get('random_val')
+        )
+
+    @staticmethod
+    def _get_jokes_by_ids(joke_ids: List[str]) -> List[JokeResponse]:
+        """
+        Fetch jokes by ID with batched get_all reads instead of one get per ID.
+        Long ID lists are split into chunks that are fetched concurrently.
+        
+        Args:
+            joke_ids: IDs of the jokes to fetch
+        
+        Returns:
+            Jokes in the order of joke_ids; IDs without a joke document are skipped
+        """
+        if not joke_ids:
+            return []
+
+        db = _get_db()
+        jokes_ref = _jokes_ref()
+
+        def fetch(chunk: List[str]):
+            refs = [jokes_ref.document(joke_id) for joke_id in chunk]
+            return list(db.get_all(refs, field_paths=JOKE_FIELDS))
+
+        unique_ids = list(dict.fromkeys(joke_ids))
+        chunks = [unique_ids[i:i + GET_ALL_CHUNK_SIZE] for i in range(0, len(unique_ids), GET_ALL_CHUNK_SIZE)]
+        if len(chunks) == 1:
+            snapshots = fetch(chunks[0])
+        else:
+            snapshots = [doc for docs in _read_executor.map(fetch, chunks) for doc in docs]
+
+        jokes_by_id = {doc.id: FirebaseService._doc_to_joke(doc) for doc in snapshots if doc.exists}
+        return [jokes_by_id[joke_id] for joke_id in joke_ids if joke_id in jokes_by_id]
+
+    @staticmethod
+    async def _get_jokes_by_ids_async(joke_ids: List[str]) -> List[JokeResponse]:
+        """
+        Async variant of _get_jokes_by_ids on the async Firestore client.
+        Chunks of IDs are fetched concurrently with asyncio.gather.
+        
+        Args:
+            joke_ids: IDs of the jokes to fetch
+        
+        Returns:
+            Jokes in the order of joke_ids; IDs without a joke document are skipped
+        """
+        if not joke_ids:
+            return []
+
+        db = _get_async_db()
+        jokes_ref = db.collection('jokes')
+
+        async def fetch(chunk: List[str]):
+            refs = [jokes_ref.document(joke_id) for joke_id in chunk]
+            return [doc async for doc in db.get_all(refs, field_paths=JOKE_FIELDS)]
+
+        unique_ids = list(dict.fromkeys(joke_ids))
+        chunks = [unique_ids[i:i + GET_ALL_CHUNK_SIZE] for i in range(0, len(unique_ids), GET_ALL_CHUNK_SIZE)]
+        results = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+
+        jokes_by_id = {doc.id: FirebaseService._doc_to_joke(doc) for docs in results for doc in docs if doc.exists}
+        return [jokes_by_id[joke_id] for joke_id in joke_ids if joke_id in jokes_by_id]
+
     @staticmethod
     def add_to_user_created_jokes(
         joke_setup: str,
@@ -57,144 +423,167 @@ class FirebaseService:
         joke_data = {
             'joke_setup': joke_setup,
             'joke_punchline': joke_punchline,
+            'joke_punchline_lower': joke_punchline.strip().lower(),
             'joke_content': joke_content,
             'default_audio_url': default_audio_url,
             'audio_urls': audio_urls or [],
             'scenarios': scenarios or [],
             'age_range': age_range or [],
+            FILTER_KEYS_FIELD: _filter_keys(scenarios, age_range),
             'created_by_customer': True,
             'creator_id': creator_id,
-            'created_at': datetime.utcnow(),
+            'created_at': SERVER_TIMESTAMP,
             'random_val': random.random()
         }
         
-        # Add joke to jokes collection
-        # add() returns (timestamp, DocumentReference)
-        _, doc_ref = db.collection('jokes').add(joke_data)
-        joke_id = doc_ref.id
+        # Pre-generate the joke ID so the joke and the user update can be committed together
+        joke_ref = _jokes_ref().document()
+        joke_id = joke_ref.id
 
         # Add joke_id to user's creation_history
-        user_ref = db.collection('users').document(creator_id)
-        user_doc = user_ref.get()
+        user_ref = _users_ref().document(creator_id)
 
-        if not user_doc.exists:
-            # Create user document if it doesn't exist
-            user_data = {
-                'user_display_name': '',
-                'user_email': '',
-                'country': '',
-                'favorites': [],
-                'like_history': [],
-                'dislike_history': [],
-                'creation_history': [joke_id],
-                'joke_jar': [],
-                'voices': [],
-                'settings': {},
-                'age_range': '',
-                'scenario': '',
-                'voice_to_use': '',
-                'created_at': datetime.utcnow()
-            }
-            user_ref.set(user_data)
-        else:
-            # Update existing user document
-            user_data = user_doc.to_dict()
-            creation_history = user_data.get('creation_history', [])
-            if joke_id not in creation_history:
-                creation_history.append(joke_id)
-                user_ref.update({'creation_history': creation_history})
+        # Read the user and write both documents in one transaction, so concurrent
+        # first-time creations can't both see a missing user and overwrite each other
+        @transactional
+        def _create(transaction):
+            user_doc = user_ref.get(field_paths=['creation_history'], transaction=transaction)
+            transaction.set(joke_ref, joke_data)
+            if not user_doc.exists:
+                # Create user document if it doesn't exist
+                user_data = _new_user_doc(creation_history=[joke_id])
+                transaction.set(user_ref, user_data)
+            else:
+                # Update existing user document
+                transaction.update(user_ref, {'creation_history': ArrayUnion([joke_id])})
+
+        _create(db.transaction())
+        _invalidate_jokes_cache()
+        _invalidate_user_jokes_cache(creator_id, 'creation_history')
 
         return joke_id
 
     @staticmethod
-    def get_all_jokes() -> List[JokeResponse]:
-        """Get all jokes from Firestore"""
-        db = _get_db()
+    async def get_all_jokes(limit: int = 50, start_after: Optional[str] = None) -> Tuple[List[JokeResponse], Optional[str]]:
+        """
+        Get a page of jokes from Firestore, newest first.
+        
+        Args:
+            limit: Maximum number of jokes to return
+            start_after: joke_id of the last joke of the previous page (cursor)
+        
+        Returns:
+            Tuple of (jokes, next_cursor); next_cursor is None on the last page
+        """
+        cache_key = (limit, start_after)
+        with _jokes_cache_lock:
+            cached = _jokes_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        db = _get_async_db()
         jokes_ref = db.collection('jokes')
-        docs = jokes_ref.order_by('created_at', direction='DESCENDING').stream()
+        query = jokes_ref.select(JOKE_FIELDS).order_by('created_at', direction='DESCENDING').limit(limit)
+        if start_after:
+            cursor_doc = await jokes_ref.document(start_after).get()
+            if cursor_doc.exists:
+                query = query.start_after(cursor_doc)
 
         jokes = []
-        for doc in docs:
-            data = doc.to_dict()
-            # Convert Firestore timestamp to datetime if needed
-            created_at = data.get('created_at')
-            if hasattr(created_at, 'timestamp'):
-                created_at = datetime.fromtimestamp(created_at.timestamp())
-
-            joke = JokeResponse(
-                joke_id=doc.id,
-                joke_setup=data.get('joke_setup', ''),
-                joke_punchline=data.get('joke_punchline', ''),
-                joke_content=data.get('joke_content', ''),
-                default_audio_url=data.get('default_audio_url', data.get('default_audio_id', '')),  # Support old field name for backward compatibility
-                audio_urls=FirebaseService._normalize_audio_urls(data.get('audio_urls', data.get('audio_ids', []))),  # Support old field name for backward compatibility
-                scenarios=data.get('scenarios', []),
-                age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-                emoji=data.get('emoji', ''),
-                created_by_customer=data.get('created_by_customer', False),
-                creator_id=data.get('creator_id', ''),
-                created_at=created_at,
-                random_val=data.get('random_val')
-            )
-            jokes.append(joke)
+        async for doc in query.stream():
+            jokes.append(FirebaseService._doc_to_joke(doc))
+
+        next_cursor = jokes[-1].joke_id if len(jokes) == limit else None
+        result = (jokes, next_cursor)
+        with _jokes_cache_lock:
+            _jokes_cache[cache_key] = result
+        return result
 
-        return jokes
 
+    @staticmethod
+    def _get_user_list_jokes(user_id: str, field: str) -> List[JokeResponse]:
+        """
+        Get the jokes referenced by one of a user's joke ID arrays, cached briefly per user.
         
+        Args:
+            user_id: ID of the user
+            field: User array field holding joke IDs (e.g. 'favorites', 'like_history')
+        
+        Returns:
+            List of jokes in the order stored on the user
+        """
+        cache_key = (field, user_id)
+        with _user_jokes_cache_lock:
+            cached = _user_jokes_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        user_doc = _users_ref().document(user_id).get(field_paths=[field])
+        joke_ids = user_doc.to_dict().get(field, []) if user_doc.exists else []
+        jokes = FirebaseService._get_jokes_by_ids(joke_ids)
+
+        with _user_jokes_cache_lock:
+            _user_jokes_cache[cache_key] = jokes
+        return list(jokes)
 
     @staticmethod
-    def get_user_created_jokes(user_id: str) -> List[JokeResponse]:
-        """Get all jokes created by a user"""
-        db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+    async def _get_user_list_jokes_async(user_id: str, field: str) -> List[JokeResponse]:
+        """
+        Async variant of _get_user_list_jokes, sharing the same per-user cache.
+        
+        Args:
+            user_id: ID of the user
+            field: User array field holding joke IDs (e.g. 'favorites', 'like_history')
+        
+        Returns:
+            List of jokes in the order stored on the user
+        """
+        cache_key = (field, user_id)
+        with _user_jokes_cache_lock:
+            cached = _user_jokes_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
 
-        if not user_doc.exists:
-            return []
+        user_doc = await _get_async_db().collection('users').document(user_id).get(field_paths=[field])
+        joke_ids = user_doc.to_dict().get(field, []) if user_doc.exists else []
+        jokes = await FirebaseService._get_jokes_by_ids_async(joke_ids)
 
-        user_data = user_doc.to_dict()
-        created_joke_ids = user_data.get('creation_history', [])
+        with _user_jokes_cache_lock:
+            _user_jokes_cache[cache_key] = jokes
+        return list(jokes)
 
-        if not created_joke_ids:
-            return []
+    @staticmethod
+    async def get_user_created_jokes_async(user_id: str) -> List[JokeResponse]:
+        """Get all jokes created by a user without blocking the event loop"""
+        return await FirebaseService._get_user_list_jokes_async(user_id, 'creation_history')
 
-        jokes = []
-        for joke_id in created_joke_ids:
-            joke_ref = db.collection('jokes').document(joke_id)
-            joke_doc = joke_ref.get()
-
-            if joke_doc.exists:
-                data = joke_doc.to_dict()
-                created_at = data.get('created_at')
-                if hasattr(created_at, 'timestamp'):
-                    created_at = datetime.fromtimestamp(created_at.timestamp())
-
-                joke = JokeResponse(
-                    joke_id=joke_doc.id,
-                    joke_setup=data.get('joke_setup', ''),
-                    joke_punchline=data.get('joke_punchline', ''),
-                    joke_content=data.get('joke_content', ''),
-                    default_audio_url=data.get('default_audio_url', ''),  # Support old field name for backward compatibility
-                    audio_urls=data.get('audio_urls', []),  # Support old field name for backward compatibility
-                    scenarios=data.get('scenarios', []),
-                    age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-                    emoji=data.get('emoji', ''),
-                    created_by_customer=data.get('created_by_customer', False),
-                    creator_id=data.get('creator_id', ''),
-                    created_at=created_at
-                )
-                jokes.append(joke)
+    @staticmethod
+    async def get_favorite_jokes_async(user_id: str) -> List[JokeResponse]:
+        """Get all favorite jokes for a user without blocking the event loop"""
+        return await FirebaseService._get_user_list_jokes_async(user_id, 'favorites')
 
-        return jokes
+    @staticmethod
+    async def get_liked_jokes_async(user_id: str) -> List[JokeResponse]:
+        """Get all liked jokes for a user without blocking the event loop"""
+        return await FirebaseService._get_user_list_jokes_async(user_id, 'like_history')
+
+    @staticmethod
+    async def get_disliked_jokes_async(user_id: str) -> List[JokeResponse]:
+        """Get all disliked jokes for a user without blocking the event loop"""
+        return await FirebaseService._get_user_list_jokes_async(user_id, 'dislike_history')
+
+    @staticmethod
+    def get_user_created_jokes(user_id: str) -> List[JokeResponse]:
+        """Get all jokes created by a user"""
+        return FirebaseService._get_user_list_jokes(user_id, 'creation_history')
 
     @staticmethod
     def delete_user_created_joke(user_id: str, joke_id: str) -> bool:
         """Remove a joke from user's creation_history"""
-        db = _get_db()
-        user_ref = db.collection('users').document(user_id)
+        user_ref = _users_ref().document(user_id)
 
         # Get current user document
-        user_doc = user_ref.get()
+        user_doc = user_ref.get(field_paths=['creation_history'])
 
         if not user_doc.exists:
             return False
@@ -205,8 +594,8 @@ class FirebaseService:
 
         # Remove joke_id if it exists in creation_history
         if joke_id in creation_history:
-            creation_history.remove(joke_id)
-            user_ref.update({'creation_history': creation_history})
+            user_ref.update({'creation_history': ArrayRemove([joke_id])})
+            _invalidate_user_jokes_cache(user_id, 'creation_history')
             return True
         else:
             # Joke not in creation_history
@@ -215,496 +604,448 @@ class FirebaseService:
     @staticmethod
     def get_favorite_jokes(user_id: str) -> List[JokeResponse]:
         """Get all favorite jokes for a user"""
-        db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
-
-        if not user_doc.exists:
-            return []
-
-        user_data = user_doc.to_dict()
-        favorite_ids = user_data.get('favorites', [])
-
-        if not favorite_ids:
-            return []
-
-        # Get all jokes that are in favorites
-        jokes = []
-        for joke_id in favorite_ids:
-            joke_ref = db.collection('jokes').document(joke_id)
-            joke_doc = joke_ref.get()
-
-            if joke_doc.exists:
-                data = joke_doc.to_dict()
-                # Convert Firestore timestamp to datetime if needed
-                created_at = data.get('created_at')
-                if hasattr(created_at, 'timestamp'):
-                    created_at = datetime.fromtimestamp(created_at.timestamp())
-
-                joke = JokeResponse(
-                    joke_id=joke_doc.id,
-                    joke_setup=data.get('joke_setup', ''),
-                    joke_punchline=data.get('joke_punchline', ''),
-                    joke_content=data.get('joke_content', ''),
-                    default_audio_id=data.get('default_audio_id', ''),
-                    audio_ids=data.get('audio_ids', []),
-                    scenarios=data.get('scenarios', []),
-                    age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-                    emoji=data.get('emoji', ''),
-                    created_by_customer=data.get('created_by_customer', False),
-                    creator_id=data.get('creator_id', ''),
-                    created_at=created_at,
-                    random_val=data.get('random_val')
-                )
-                jokes.append(joke)
-
-        return jokes
+        return FirebaseService._get_user_list_jokes(user_id, 'favorites')
 
     @staticmethod
     def get_user_joke_ids(user_id: str) -> Dict[str, List[str]]:
         """
         Get all favorite, liked, and disliked joke IDs for a user in a single query.
+        Results are cached briefly and dropped whenever one of the user's lists changes.
         Returns: {
             'favorite_joke_ids': List[str],
             'liked_joke_ids': List[str],
-            'disliked_joke_ids': List[str]
+            'disliked_joke_ids': List[str],
+            'joke_jar_ids': List[str]
         }
         """
-        db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        with _user_joke_ids_cache_lock:
+            cached = _user_joke_ids_cache.get(user_id)
+        if cached is not None:
+            # Copies, so callers mutating the lists can't corrupt the cache
+            return {key: list(ids) for key, ids in cached.items()}
 
-        if not user_doc.exists:
-            return {
-                'favorite_joke_ids': [],
-                'liked_joke_ids': [],
-                'disliked_joke_ids': []
-            }
+        user_ref = _users_ref().document(user_id)
+        user_doc = user_ref.get(field_paths=['favorites', 'like_history', 'dislike_history', 'joke_jar'])
 
-        user_data = user_doc.to_dict()
+        user_data = user_doc.to_dict() if user_doc.exists else {}
         favorite_ids = user_data.get('favorites', [])
         liked_ids = user_data.get('like_history', [])
         disliked_ids = user_data.get('dislike_history', [])
         joke_jar_ids = user_data.get('joke_jar', [])
 
-        return {
+        result = {
             'favorite_joke_ids': favorite_ids if favorite_ids else [],
             'liked_joke_ids': liked_ids if liked_ids else [],
             'disliked_joke_ids': disliked_ids if disliked_ids else [],
             'joke_jar_ids': joke_jar_ids if joke_jar_ids else []
         }
+        with _user_joke_ids_cache_lock:
+            _user_joke_ids_cache[user_id] = result
+        return {key: list(ids) for key, ids in result.items()}
 
     @staticmethod
     def add_to_favorite_jokes(user_id: str, joke_id: str) -> bool:
         """Add a joke to user's favorites list"""
         db = _get_db()
-        user_ref = db.collection('users').document(user_id)
+        user_ref = _users_ref().document(user_id)
 
-        # Get current user document
-        user_doc = user_ref.get()
+        # Read and write the user in one transaction, so concurrent toggles can't
+        # both see the joke missing and double count it
+        @transactional
+        def _add(transaction) -> bool:
+            user_doc = user_ref.get(field_paths=['favorites'], transaction=transaction)
 
-        if not user_doc.exists:
-            # Create user document if it doesn't exist
-            user_data = {
-                'user_display_name': '',
-                'user_email': '',
-                'country': '',
-                'favorites': [joke_id],
-                'like_history': [],
-                'dislike_history': [],
-                'creation_history': [],
-                'joke_jar': [],
-                'voices': [],
-                'settings': {},
-                'age_range': '',
-                'scenario': '',
-                'voice_to_use': '',
-                'created_at': datetime.utcnow()
-            }
-            user_ref.set(user_data)
-            # Update joke_metadata: increment saved_to_favorite_times
-            FirebaseService._update_joke_metadata_counter(joke_id, 'saved_to_favorite_times', 1)
-            return True
-        
-        # Get current favorites
-        user_data = user_doc.to_dict()
-        favorites = user_data.get('favorites', [])
-
-        # Add joke_id if not already in favorites
-        if joke_id not in favorites:
-            favorites.append(joke_id)
-            user_ref.update({'favorites': favorites})
-            # Update joke_metadata: increment saved_to_favorite_times
-            FirebaseService._update_joke_metadata_counter(joke_id, 'saved_to_favorite_times', 1)
+            if not user_doc.exists:
+                # Create user document if it doesn't exist
+                transaction.set(user_ref, _new_user_doc(favorites=[joke_id]))
+            elif joke_id not in user_doc.to_dict().get('favorites', []):
+                # Add joke_id if not already in favorites
+                transaction.update(user_ref, {'favorites': ArrayUnion([joke_id])})
+            else:
+                # Already in favorites
+                return False
             return True
-        else:
-            # Already in favorites
+
+        if not _add(db.transaction()):
             return False
+        _invalidate_user_jokes_cache(user_id, 'favorites')
+        # Update joke_metadata: increment saved_to_favorite_times
+        FirebaseService._update_joke_metadata_counter(joke_id, 'saved_to_favorite_times', 1)
+        return True
     
     @staticmethod
     def delete_favorite_jokes(user_id: str, joke_id: str) -> bool:
         """Remove a joke from user's favorites list"""
         db = _get_db()
-        user_ref = db.collection('users').document(user_id)
+        user_ref = _users_ref().document(user_id)
 
-        # Get current user document
-        user_doc = user_ref.get()
+        @transactional
+        def _delete(transaction) -> bool:
+            user_doc = user_ref.get(field_paths=['favorites'], transaction=transaction)
 
-        if not user_doc.exists:
-            return False
+            # Joke not in favorites (or no user)
+            if not user_doc.exists or joke_id not in user_doc.to_dict().get('favorites', []):
+                return False
 
-        # Get current favorites
-        user_data = user_doc.to_dict()
-        favorites = user_data.get('favorites', [])
-
-        # Remove joke_id if it exists in favorites
-        if joke_id in favorites:
-            favorites.remove(joke_id)
-            user_ref.update({'favorites': favorites})
-            # Update joke_metadata: decrement saved_to_favorite_times
-            FirebaseService._update_joke_metadata_counter(joke_id, 'saved_to_favorite_times', -1)
+            transaction.update(user_ref, {'favorites': ArrayRemove([joke_id])})
             return True
-        else:
-            # Joke not in favorites
+
+        if not _delete(db.transaction()):
             return False
+        _invalidate_user_jokes_cache(user_id, 'favorites')
+        # Update joke_metadata: decrement saved_to_favorite_times
+        FirebaseService._update_joke_metadata_counter(joke_id, 'saved_to_favorite_times', -1)
+        return True
 
     @staticmethod
     def add_to_user_liked_history(user_id: str, joke_id: str) -> bool:
         """Add joke to user's like_history and remove from dislike_history"""
         db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        user_ref = _users_ref().document(user_id)
 
-        if not user_doc.exists:
-            user_data = {
-                'user_display_name': '',
-                'user_email': '',
-                'country': '',
-                'favorites': [],
-                'like_history': [joke_id],
-                'dislike_history': [],
-                'creation_history': [],
-                'joke_jar': [],
-                'voices': [],
-                'settings': {},
-                'age_range': '',
-                'scenario': '',
-                'voice_to_use': '',
-                'created_at': datetime.utcnow()
-            }
-            user_ref.set(user_data)
-            # Update joke_metadata: increment liked_times
-            FirebaseService._update_joke_metadata_counter(joke_id, 'liked_times', 1)
-            return True
+        # The membership read, the user update and the counter bumps commit atomically,
+        # so concurrent votes can't both count against the same state
+        @transactional
+        def _like(transaction) -> bool:
+            user_doc = user_ref.get(field_paths=['like_history', 'dislike_history'], transaction=transaction)
 
-        user_data = user_doc.to_dict()
-        like_history = user_data.get('like_history', [])
-        dislike_history = user_data.get('dislike_history', [])
-
-        was_in_dislike = joke_id in dislike_history
-        updated = False
-        if joke_id not in like_history:
-            like_history.append(joke_id)
-            updated = True
-        if joke_id in dislike_history:
-            dislike_history.remove(joke_id)
-            updated = True
-
-        if updated:
-            user_ref.update({
-                'like_history': like_history,
-                'dislike_history': dislike_history
-            })
-            # Update joke_metadata: increment liked_times, decrement disliked_times if it was there
-            FirebaseService._update_joke_metadata_counter(joke_id, 'liked_times', 1)
+            if not user_doc.exists:
+                transaction.set(user_ref, _new_user_doc(like_history=[joke_id]))
+                # Update joke_metadata: increment liked_times
+                FirebaseService._add_metadata_increments(transaction, joke_id, {'liked_times': 1})
+                return True
+
+            user_data = user_doc.to_dict()
+            like_history = user_data.get('like_history', [])
+            dislike_history = user_data.get('dislike_history', [])
+
+            was_in_dislike = joke_id in dislike_history
+            if joke_id in like_history and not was_in_dislike:
+                return False
+
+            # Add to like_history and drop from dislike_history,
+            # increment liked_times and decrement disliked_times if it was there
+            increments = {'liked_times': 1}
             if was_in_dislike:
-                FirebaseService._update_joke_metadata_counter(joke_id, 'disliked_times', -1)
+                increments['disliked_times'] = -1
+            transaction.update(user_ref, {
+                'like_history': ArrayUnion([joke_id]),
+                'dislike_history': ArrayRemove([joke_id])
+            })
+            FirebaseService._add_metadata_increments(transaction, joke_id, increments)
             return True
-        return False
+
+        if not _like(db.transaction()):
+            return False
+        _invalidate_user_jokes_cache(user_id, 'like_history', 'dislike_history')
+        return True
 
     @staticmethod
     def add_to_user_disliked_history(user_id: str, joke_id: str) -> bool:
         """Add joke to user's dislike_history and remove from like_history"""
         db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        user_ref = _users_ref().document(user_id)
 
-        if not user_doc.exists:
-            user_data = {
-                'user_display_name': '',
-                'user_email': '',
-                'country': '',
-                'favorites': [],
-                'like_history': [],
-                'dislike_history': [joke_id],
-                'creation_history': [],
-                'joke_jar': [],
-                'voices': [],
-                'settings': {},
-                'age_range': '',
-                'scenario': '',
-                'voice_to_use': '',
-                'created_at': datetime.utcnow()
-            }
-            user_ref.set(user_data)
-            # Update joke_metadata: increment disliked_times
-            FirebaseService._update_joke_metadata_counter(joke_id, 'disliked_times', 1)
+        @transactional
+        def _dislike(transaction) -> bool:
+            user_doc = user_ref.get(field_paths=['like_history', 'dislike_history'], transaction=transaction)
+
+            if not user_doc.exists:
+                transaction.set(user_ref, _new_user_doc(dislike_history=[joke_id]))
+                # Update joke_metadata: increment disliked_times
+                FirebaseService._add_metadata_increments(transaction, joke_id, {'disliked_times': 1})
+                return True
+
+            # Get current like_history and dislike_history
+            user_data = user_doc.to_dict()
+            like_history = user_data.get('like_history', [])
+            dislike_history = user_data.get('dislike_history', [])
+
+            was_in_like = joke_id in like_history
+            if joke_id in dislike_history and not was_in_like:
+                return False
+
+            # Drop from like_history and add to dislike_history,
+            # increment disliked_times and decrement liked_times if it was there
+            increments = {'disliked_times': 1}
+            if was_in_like:
+                increments['liked_times'] = -1
+            transaction.update(user_ref, {
+                'like_history': ArrayRemove([joke_id]),
+                'dislike_history': ArrayUnion([joke_id])
+            })
+            FirebaseService._add_metadata_increments(transaction, joke_id, increments)
             return True
 
-        # Get current like_history and dislike_history
-        user_data = user_doc.to_dict()
-        like_history = user_data.get('like_history', [])
-        dislike_history = user_data.get('dislike_history', [])
-
-        was_in_like = joke_id in like_history
-        
-        # Remove from like_history if present
-        if joke_id in like_history:
-            like_history.remove(joke_id)
-        
-        # Add to dislike_history if not already present
-        if joke_id not in dislike_history:
-            dislike_history.append(joke_id)
-        
-        # Update user document
-        user_ref.update({
-            'like_history': like_history,
-            'dislike_history': dislike_history
-        })
-        # Update joke_metadata: increment disliked_times, decrement liked_times if it was there
-        FirebaseService._update_joke_metadata_counter(joke_id, 'disliked_times', 1)
-        if was_in_like:
-            FirebaseService._update_joke_metadata_counter(joke_id, 'liked_times', -1)
+        if not _dislike(db.transaction()):
+            return False
+        _invalidate_user_jokes_cache(user_id, 'like_history', 'dislike_history')
         return True
     
     @staticmethod
     def get_liked_jokes(user_id: str) -> List[JokeResponse]:
         """Get all liked jokes for a user"""
-        db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            return []
-        
-        user_data = user_doc.to_dict()
-        liked_ids = user_data.get('like_history', [])
-        
-        if not liked_ids:
-            return []
-        
-        # Get all jokes that are in like_history
-        jokes = []
-        for joke_id in liked_ids:
-            joke_ref = db.collection('jokes').document(joke_id)
-            joke_doc = joke_ref.get()
-            
-            if joke_doc.exists:
-                data = joke_doc.to_dict()
-                # Convert Firestore timestamp to datetime if needed
-                created_at = data.get('created_at')
-                if hasattr(created_at, 'timestamp'):
-                    created_at = datetime.fromtimestamp(created_at.timestamp())
-                
-                joke = JokeResponse(
-                    joke_id=joke_doc.id,
-                    joke_setup=data.get('joke_setup', ''),
-                    joke_punchline=data.get('joke_punchline', ''),
-                    joke_content=data.get('joke_content', ''),
-                    default_audio_url=data.get('default_audio_url', data.get('default_audio_id', '')),  # Support old field name for backward compatibility
-                    audio_urls=FirebaseService._normalize_audio_urls(data.get('audio_urls', data.get('audio_ids', []))),  # Support old field name for backward compatibility
-                    scenarios=data.get('scenarios', []),
-                    age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-                    emoji=data.get('emoji', ''),
-                    created_by_customer=data.get('created_by_customer', False),
-                    creator_id=data.get('creator_id', ''),
-                    created_at=created_at
-                )
-                jokes.append(joke)
-        
-        return jokes
-    
+        return FirebaseService._get_user_list_jokes(user_id, 'like_history')
+
     @staticmethod
-    def get_random_jokes(limit: int = 10, age_range: Optional[str] = None, scenario: Optional[str] = None) -> List[JokeResponse]:
-        """Get random jokes from Firestore, optionally filtered by age_range and scenario"""
-        db = _get_db()
+    def get_random_jokes(
+        limit: int = 10,
+        age_range: Optional[str] = None,
+        scenario: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> List[JokeResponse]:
+        """
+        Get random jokes from Firestore, optionally filtered by age_range and scenario.
+        A joke matches a filter if it lists the value or lists no values for it; "all" matches every joke.
+        Filtering happens in the query (on filter_keys), so only matching jokes are read; if that
+        finds too few, jokes without filter_keys yet are over-fetched and matched in Python.
+        
+        Args:
+            limit: Maximum number of jokes to return
+            age_range: Age range to filter by
+            scenario: Scenario to filter by
+            fields: Joke fields to fetch (defaults to JOKE_FIELDS); fields left out, such as
+                    joke_content or audio_urls, are returned empty and not sent over the wire
+        """
+        fields = fields or JOKE_FIELDS
         threshold = random.random()
         direction = random.choice([True, False])
 
-        jokes_ref = db.collection('jokes')
-        
-        # Build query based on direction
-        # Query more than limit to account for filtering by age_range/scenario
-        query_limit = limit * 10  # Query up to 10x the limit to ensure we have enough after filtering
-        
-        if direction:
-            # Direction True: get jokes where random_val >= threshold, ordered ascending
-            query = jokes_ref.where('random_val', '>=', threshold).order_by('random_val', direction='ASCENDING').limit(query_limit)
+        jokes_ref = _jokes_ref()
+        
+        scenario_lower = scenario.strip().lower() if scenario and scenario.strip() else "all"
+        age_range_lower = age_range.strip().lower() if age_range and age_range.strip() else "all"
+        scenario_keys = [f"s:{v}" for v in (scenario_lower, FILTER_KEY_ANY)]
+        age_keys = [f"a:{v}" for v in (age_range_lower, FILTER_KEY_ANY)]
+        if scenario_lower != "all" and age_range_lower != "all":
+            filter_keys = [f"{s}|{a}" for s in scenario_keys for a in age_keys]
+        elif scenario_lower != "all":
+            filter_keys = scenario_keys
+        elif age_range_lower != "all":
+            filter_keys = age_keys
         else:
-            # Direction False: get jokes where random_val <= threshold, ordered descending
-            query = jokes_ref.where('random_val', '<=', threshold).order_by('random_val', direction='DESCENDING').limit(query_limit)
-        
-        docs = list(query.stream())
+            filter_keys = None
+        
+        def _random_docs(ref, query_limit: int, select: List[str]):
+            """Up to query_limit docs of ref in random_val order from the threshold, in the chosen direction"""
+            if direction:
+                # Direction True: get jokes where random_val >= threshold, ordered ascending,
+                # wrapping around to the lowest random_val values if that side runs out
+                query = ref.where('random_val', '>=', threshold).order_by('random_val', direction='ASCENDING')
+                wrap_query = ref.where('random_val', '<', threshold).order_by('random_val', direction='ASCENDING')
+            else:
+                # Direction False: get jokes where random_val <= threshold, ordered descending,
+                # wrapping around to the highest random_val values if that side runs out
+                query = ref.where('random_val', '<=', threshold).order_by('random_val', direction='DESCENDING')
+                wrap_query = ref.where('random_val', '>', threshold).order_by('random_val', direction='DESCENDING')
+            seen = 0
+            for q in (query, wrap_query):
+                for doc in q.select(select).limit(query_limit - seen).stream():
+                    seen += 1
+                    yield doc
+                if seen >= query_limit:
+                    return
+        
+        query_ref = jokes_ref.where(FILTER_KEYS_FIELD, 'array_contains_any', filter_keys) if filter_keys else jokes_ref
+        jokes = [FirebaseService._doc_to_joke(doc) for doc in _random_docs(query_ref, limit, fields)]
+        
+        if filter_keys and len(jokes) < limit:
+            # Jokes saved before filter_keys existed aren't matched by the query until
+            # migrate_add_filter_keys has run: over-fetch unfiltered jokes and match them here
+            # on the keys they would have
+            returned_ids = {joke.joke_id for joke in jokes}
+            wanted_keys = set(filter_keys)
+            select = list(dict.fromkeys(fields + ['scenarios', 'age_range', 'ages', FILTER_KEYS_FIELD]))
+            for doc in _random_docs(jokes_ref, (limit - len(jokes)) * 10, select):
+                if doc.id in returned_ids or doc.to_dict().get(FILTER_KEYS_FIELD) is not None:
+                    continue
+                joke = FirebaseService._doc_to_joke(doc)
+                if wanted_keys.intersection(_filter_keys(joke.scenarios, joke.age_range)):
+                    jokes.append(joke)
+                    if len(jokes) >= limit:
+                        break
         
-        jokes = []
-        for doc in docs:
-            data = doc.to_dict()
-            # Skip jokes without random_val (old jokes)
-            if data.get('random_val') is None:
-                continue
-                
-            created_at = data.get('created_at')
-            if hasattr(created_at, 'timestamp'):
-                created_at = datetime.fromtimestamp(created_at.timestamp())
-            
-            joke = JokeResponse(
-                joke_id=doc.id,
-                joke_setup=data.get('joke_setup', ''),
-                joke_punchline=data.get('joke_punchline', ''),
-                joke_content=data.get('joke_content', ''),
-                default_audio_url=data.get('default_audio_url', ''),  # Support old field name for backward compatibility
-                audio_urls=data.get('audio_urls', []),  # Support old field name for backward compatibility
-                scenarios=data.get('scenarios', []),
-                age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-                emoji=data.get('emoji', ''),
-                created_by_customer=data.get('created_by_customer', False),
-                creator_id=data.get('creator_id', ''),
-                created_at=created_at,
-                random_val=data.get('random_val')
-            )
-            
-            # Filter by scenario: 
-            # - If scenario is "all" or empty/None, match all jokes (no filtering)
-            # - If scenario is provided, match if scenario is in joke's scenarios OR joke's scenarios is empty
-            scenario_match = True
-            if scenario and scenario.strip():
-                scenario_lower = scenario.strip().lower()
-                if scenario_lower != "all":
-                    joke_scenarios = joke.scenarios or []
-                    scenario_match = scenario_lower in [s.lower() for s in joke_scenarios] or len(joke_scenarios) == 0
-            
-            # Filter by age_range:
-            # - If age_range is "all" or empty/None, match all jokes (no filtering)
-            # - If age_range is provided, match if age_range is in joke's age_range OR joke's age_range is empty
-            age_match = True
-            if age_range and age_range.strip():
-                age_range_lower = age_range.strip().lower()
-                if age_range_lower != "all":
-                    joke_age_ranges = joke.age_range or []
-                    age_match = age_range_lower in [a.lower() for a in joke_age_ranges] or len(joke_age_ranges) == 0
-            
-            # Only include jokes that match both filters
-            if scenario_match and age_match:
-                jokes.append(joke)
-                # Stop once we have enough jokes
-                if len(jokes) >= limit:
-                    break
-        
-        return jokes[:limit]
+        return jokes
+    
+    @staticmethod
+    def content_joke_id(joke_setup: str, joke_punchline: str) -> str:
+        """
+        Deterministic joke ID derived from the normalized setup and punchline,
+        so a joke's document can be looked up directly instead of queried.
+        """
+        content = f"{joke_setup.strip().lower()}|{joke_punchline.strip().lower()}"
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
     
     @staticmethod
     def joke_exists(joke_setup: str, joke_punchline: str) -> bool:
         """Check if a joke with the same setup and punchline already exists"""
-        db = _get_db()
-        jokes_ref = db.collection('jokes')
-        
-        # Query for jokes with matching setup and punchline
-        setup_query = jokes_ref.where('joke_setup', '==', joke_setup).stream()
-        for doc in setup_query:
-            data = doc.to_dict()
-            if data.get('joke_punchline', '').strip().lower() == joke_punchline.strip().lower():
-                return True
-        
-        return False
+        return FirebaseService.get_joke_doc_by_setup_punchline(joke_setup, joke_punchline)[0] is not None
     
     @staticmethod
     def get_joke_doc_by_setup_punchline(joke_setup: str, joke_punchline: str):
         """Get a joke document reference by setup and punchline, returns (doc_ref, data) or (None, None)"""
-        db = _get_db()
-        jokes_ref = db.collection('jokes')
+        jokes_ref = _jokes_ref()
         
-        # Query for jokes with matching setup
-        setup_query = jokes_ref.where('joke_setup', '==', joke_setup).stream()
-        for doc in setup_query:
+        # Jokes saved under their content ID are a single direct document read
+        doc = jokes_ref.document(FirebaseService.content_joke_id(joke_setup, joke_punchline)).get()
+        if doc.exists:
             data = doc.to_dict()
-            if data.get('joke_punchline', '').strip().lower() == joke_punchline.strip().lower():
+            if FirebaseService._joke_key(data.get('joke_setup', ''), data.get('joke_punchline', '')) == FirebaseService._joke_key(joke_setup, joke_punchline):
                 return doc.reference, data
         
+        # Older jokes have random IDs: match on setup and the stored lowercase punchline
+        # so at most one document is read
+        query = (
+            jokes_ref.where('joke_setup', '==', joke_setup)
+            .where('joke_punchline_lower', '==', joke_punchline.strip().lower())
+            .limit(1)
+        )
+        doc = next(query.stream(), None)
+        if doc is not None:
+            return doc.reference, doc.to_dict()
+        
+        # Jokes saved before joke_punchline_lower existed (until migrate_add_punchline_lower has run):
+        # compare the punchline of each joke with this setup
+        punchline_lower = joke_punchline.strip().lower()
+        for doc in jokes_ref.where('joke_setup', '==', joke_setup).select(['joke_punchline', 'joke_punchline_lower']).stream():
+            data = doc.to_dict()
+            if data.get('joke_punchline_lower') is None and data.get('joke_punchline', '').strip().lower() == punchline_lower:
+                return doc.reference, doc.reference.get().to_dict()
+        
         return None, None
     
+    @staticmethod
+    def _joke_key(joke_setup: str, joke_punchline: str) -> Tuple[str, str]:
+        """Normalized (setup, punchline) pair, the same normalization content_joke_id hashes"""
+        return joke_setup.strip().lower(), joke_punchline.strip().lower()
+    
+    @staticmethod
+    def _get_existing_joke_docs(jokes: List[Tuple[str, str]]) -> Dict[Tuple[str, str], tuple]:
+        """
+        Find the stored documents of many jokes at once.
+        Content-ID documents are read directly with batched get_all; jokes not found
+        there are looked up among older random-ID jokes with chunked 'in' queries on the setup.
+        
+        Args:
+            jokes: (joke_setup, joke_punchline) pairs to look up
+        
+        Returns:
+            Dict mapping the normalized (setup, punchline) pair (see _joke_key) to (doc_ref, data)
+        """
+        db = _get_db()
+        jokes_ref = _jokes_ref()
+        fields = ['joke_setup', 'joke_punchline', 'scenarios', 'age_range']
+        
+        wanted = {}
+        for joke_setup, joke_punchline in jokes:
+            if joke_setup:
+                wanted.setdefault(FirebaseService._joke_key(joke_setup, joke_punchline), (joke_setup, joke_punchline))
+        
+        existing = {}
+        refs = [jokes_ref.document(FirebaseService.content_joke_id(*joke)) for joke in wanted.values()]
+        for i in range(0, len(refs), GET_ALL_CHUNK_SIZE):
+            for doc in db.get_all(refs[i:i + GET_ALL_CHUNK_SIZE], field_paths=fields):
+                if doc.exists:
+                    data = doc.to_dict()
+                    existing[FirebaseService._joke_key(data.get('joke_setup', ''), data.get('joke_punchline', ''))] = (doc.reference, data)
+        
+        # Older jokes have random IDs and are matched on their exact setup
+        unique_setups = list(dict.fromkeys(setup for key, (setup, _) in wanted.items() if key not in existing))
+        for i in range(0, len(unique_setups), IN_QUERY_CHUNK_SIZE):
+            chunk = unique_setups[i:i + IN_QUERY_CHUNK_SIZE]
+            query = jokes_ref.where('joke_setup', 'in', chunk).select(fields)
+            for doc in query.stream():
+                data = doc.to_dict()
+                existing.setdefault(FirebaseService._joke_key(data.get('joke_setup', ''), data.get('joke_punchline', '')), (doc.reference, data))
+        return existing
+    
+    @staticmethod
+    def resolve_joke_ids(jokes: List[Tuple[str, str]]) -> List[str]:
+        """
+        IDs under which the given jokes are (or will be) stored: the ID of an
+        existing document for the joke, otherwise its content_joke_id.
+        
+        Args:
+            jokes: (joke_setup, joke_punchline) pairs
+        
+        Returns:
+            One joke ID per pair, in order
+        """
+        existing = FirebaseService._get_existing_joke_docs(jokes)
+        joke_ids = []
+        for joke_setup, joke_punchline in jokes:
+            doc_ref, _ = existing.get(FirebaseService._joke_key(joke_setup, joke_punchline), (None, None))
+            joke_ids.append(doc_ref.id if doc_ref else FirebaseService.content_joke_id(joke_setup, joke_punchline))
+        return joke_ids
+    
     @staticmethod
     def _update_joke_metadata_counter(joke_id: str, field: str, increment: int = 1):
         """
         Helper function to update joke_metadata counter fields asynchronously.
         field: 'liked_times', 'disliked_times', or 'saved_to_favorite_times'
         increment: 1 to increment, -1 to decrement
-        Runs in a background thread to avoid blocking the main operation.
+        The delta is coalesced with other bumps of the same counter and written
+        in the background, so bursts on a popular joke become one write.
         """
-        def _update_counter():
-            try:
-                db = _get_db()
-                metadata_ref = db.collection('joke_metadata').document(joke_id)
-                metadata_doc = metadata_ref.get()
-                
-                if metadata_doc.exists:
-                    # Update existing metadata
-                    current_value = metadata_doc.to_dict().get(field, 0)
-                    new_value = max(0, current_value + increment)  # Ensure it doesn't go below 0
-                    metadata_ref.update({field: new_value})
-                else:
-                    # Create new metadata document with default values
-                    metadata_data = {
-                        'liked_times': 0,
-                        'disliked_times': 0,
-                        'saved_to_favorite_times': 0
-                    }
-                    metadata_data[field] = max(0, increment)  # Ensure it doesn't go below 0
-                    metadata_ref.set(metadata_data)
-            except Exception as e:
-                print(f"Error updating joke_metadata counter for joke {joke_id}: {str(e)}")
+        _add_pending_counter(joke_id, field, increment)
+    
+    @staticmethod
+    def _add_metadata_increments(batch, joke_id: str, increments: Dict[str, int]):
+        """
+        Add server-side increments of joke_metadata counters to a batch or transaction,
+        so the counter bump commits atomically with the user update that caused it.
+        increments: counter field -> delta, e.g. {'liked_times': 1, 'disliked_times': -1}
+        """
+        batch.set(_metadata_shard_ref(joke_id), {field: Increment(delta) for field, delta in increments.items()}, merge=True)
+    
+    @staticmethod
+    def get_joke_metadata(joke_id: str) -> Dict[str, int]:
+        """
+        Get a joke's liked_times, disliked_times and saved_to_favorite_times.
+        Sums the counter shards, plus any totals stored on the joke_metadata document itself
+        before counters were sharded, in one batched read.
+        """
+        db = _get_db()
+        metadata_ref = _joke_metadata_ref().document(joke_id)
+        shard_refs = [metadata_ref.collection('shards').document(str(i)) for i in range(METADATA_SHARDS)]
+        
+        totals = {field: 0 for field in METADATA_COUNTER_FIELDS}
+        for doc in db.get_all([metadata_ref] + shard_refs, field_paths=list(METADATA_COUNTER_FIELDS)):
+            if not doc.exists:
+                continue
+            data = doc.to_dict()
+            for field in METADATA_COUNTER_FIELDS:
+                totals[field] += data.get(field, 0) or 0
         
-        # Run the update in a background thread
-        thread = threading.Thread(target=_update_counter, daemon=True)
-        thread.start()
+        # Counters are never meant to go below 0
+        return {field: max(0, value) for field, value in totals.items()}
     
     @staticmethod
     def joke_id_exists(joke_id: str) -> bool:
         """Check if a joke with the given ID exists in Firestore"""
-        db = _get_db()
-        joke_ref = db.collection('jokes').document(joke_id)
+        joke_ref = _jokes_ref().document(joke_id)
         joke_doc = joke_ref.get()
         return joke_doc.exists
     
     @staticmethod
     def get_joke_by_id(joke_id: str) -> Optional[JokeResponse]:
-        """Get a joke by its ID"""
-        db = _get_db()
-        joke_ref = db.collection('jokes').document(joke_id)
-        joke_doc = joke_ref.get()
+        """Get a joke by its ID, served from a short-lived cache when possible"""
+        with _joke_cache_lock:
+            cached = _joke_cache.get(joke_id)
+        if cached is not None:
+            # A copy, so callers mutating the joke can't corrupt the cache
+            return cached.model_copy(deep=True)
+        
+        joke_ref = _jokes_ref().document(joke_id)
+        joke_doc = joke_ref.get(field_paths=JOKE_FIELDS)
         
         if not joke_doc.exists:
             return None
         
-        data = joke_doc.to_dict()
-        created_at = data.get('created_at')
-        if hasattr(created_at, 'timestamp'):
-            created_at = datetime.fromtimestamp(created_at.timestamp())
-        
-        return JokeResponse(
-            joke_id=joke_doc.id,
-            joke_setup=data.get('joke_setup', ''),
-            joke_punchline=data.get('joke_punchline', ''),
-            joke_content=data.get('joke_content', ''),
-            default_audio_url=data.get('default_audio_url', data.get('default_audio_id', '')),  # Support old field name for backward compatibility
-            audio_urls=data.get('audio_urls', data.get('audio_ids', [])),  # Support old field name for backward compatibility
-            scenarios=data.get('scenarios', []),
-            age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-            emoji=data.get('emoji', ''),
-            created_by_customer=data.get('created_by_customer', False),
-            creator_id=data.get('creator_id', ''),
-            created_at=created_at,
-            random_val=data.get('random_val')
-        )
+        joke = FirebaseService._doc_to_joke(joke_doc)
+        with _joke_cache_lock:
+            _joke_cache[joke_id] = joke
+        return joke.model_copy(deep=True)
     
     @staticmethod
     def get_random_liked_jokes(user_id: str, limit: int = 1) -> List[JokeResponse]:
@@ -719,14 +1060,8 @@ class FirebaseService:
         # Randomly select up to 'limit' IDs
         selected_ids = random.sample(liked_joke_ids, min(limit, len(liked_joke_ids)))
         
-        # Fetch jokes by ID
-        jokes = []
-        for joke_id in selected_ids:
-            joke = FirebaseService.get_joke_by_id(joke_id)
-            if joke:
-                jokes.append(joke)
-        
-        return jokes
+        # Fetch jokes by ID in one batched read
+        return FirebaseService._get_jokes_by_ids(selected_ids)
     
     @staticmethod
     def get_random_disliked_jokes(user_id: str, limit: int = 5) -> List[JokeResponse]:
@@ -741,14 +1076,36 @@ class FirebaseService:
         # Randomly select up to 'limit' IDs
         selected_ids = random.sample(disliked_joke_ids, min(limit, len(disliked_joke_ids)))
         
-        # Fetch jokes by ID
-        jokes = []
-        for joke_id in selected_ids:
-            joke = FirebaseService.get_joke_by_id(joke_id)
-            if joke:
-                jokes.append(joke)
+        # Fetch jokes by ID in one batched read
+        return FirebaseService._get_jokes_by_ids(selected_ids)
+    
+    @staticmethod
+    def get_random_liked_and_disliked(user_id: str, liked_limit: int = 1, disliked_limit: int = 5) -> Tuple[List[JokeResponse], List[JokeResponse]]:
+        """
+        Get random subsets of a user's liked and disliked jokes together, with one
+        user read and one batched joke read instead of one of each per list.
         
-        return jokes
+        Args:
+            user_id: ID of the user
+            liked_limit: Maximum number of liked jokes to return
+            disliked_limit: Maximum number of disliked jokes to return
+        
+        Returns:
+            (liked_jokes, disliked_jokes)
+        """
+        user_joke_ids = FirebaseService.get_user_joke_ids(user_id)
+        liked_joke_ids = user_joke_ids.get('liked_joke_ids', [])
+        disliked_joke_ids = user_joke_ids.get('disliked_joke_ids', [])
+        
+        # Randomly select up to the limit of IDs from each list
+        selected_liked = random.sample(liked_joke_ids, min(liked_limit, len(liked_joke_ids)))
+        selected_disliked = random.sample(disliked_joke_ids, min(disliked_limit, len(disliked_joke_ids)))
+        
+        # Fetch both selections in one batched read, then split them back up
+        jokes_by_id = {joke.joke_id: joke for joke in FirebaseService._get_jokes_by_ids(selected_liked + selected_disliked)}
+        liked_jokes = [jokes_by_id[joke_id] for joke_id in selected_liked if joke_id in jokes_by_id]
+        disliked_jokes = [jokes_by_id[joke_id] for joke_id in selected_disliked if joke_id in jokes_by_id]
+        return liked_jokes, disliked_jokes
     
     @staticmethod
     def get_default_audio(joke_id: str) -> Optional[str]:
@@ -761,19 +1118,14 @@ class FirebaseService:
         Returns:
             str: The audio URL for the joke, or None if not found
         """
-        db = _get_db()
+        # Get the joke (usually cached, and shared with the get_joke_by_id that follows on a miss)
+        joke = FirebaseService.get_joke_by_id(joke_id)
         
-        # Get the joke document to retrieve the audio URL
-        joke_ref = db.collection('jokes').document(joke_id)
-        joke_doc = joke_ref.get()
-        
-        if not joke_doc.exists:
+        if not joke:
             return None
         
-        joke_data = joke_doc.to_dict()
-        
         # Get audio URL
-        audio_url = joke_data.get('default_audio_url')
+        audio_url = joke.default_audio_url
         
         if audio_url:
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Getting default audio for joke {joke_id}: {audio_url}")
@@ -785,156 +1137,304 @@ class FirebaseService:
     def save_jokes_async(jokes: List[dict], creator_id: str = "gemini"):
         """Save jokes to database asynchronously (for background tasks), skipping duplicates"""
         db = _get_db()
-        saved_count = 0
         
-        for joke_data in jokes:
-            try:
-                joke_setup = joke_data.get('joke_setup', '')
-                joke_punchline = joke_data.get('joke_punchline', '')
-                new_scenarios = joke_data.get('scenarios', [])
-                new_age_range = joke_data.get('age_range', [])
-                
-                # Check if joke already exists and get its document reference
-                existing_doc_ref, existing_data = FirebaseService.get_joke_doc_by_setup_punchline(
-                    joke_setup, joke_punchline
-                )
-                
-                if existing_doc_ref and existing_data:
-                    # Joke exists - merge age_range and scenarios
-                    existing_scenarios = set(existing_data.get('scenarios', []))
-                    existing_age_range = set(existing_data.get('age_range', []))
-                    
-                    # Add new scenarios and age_range to existing sets
-                    existing_scenarios.update(new_scenarios)
-                    existing_age_range.update(new_age_range)
-                    
-                    # Update the existing joke with merged data
-                    existing_doc_ref.update({
-                        'scenarios': list(existing_scenarios),
-                        'age_range': list(existing_age_range)
-                    })
-                    saved_count += 1
-                    continue
-                
-                # Joke doesn't exist - create new joke document
-                joke_doc = {
-                    'joke_setup': joke_setup,
-                    'joke_punchline': joke_punchline,
-                    'joke_content': joke_data.get('joke_content', ''),
-                    'default_audio_url': joke_data.get('default_audio_url', ''),
-                    'audio_urls': joke_data.get('audio_urls', []),
-                    'scenarios': new_scenarios,
-                    'age_range': new_age_range,
-                    'emoji': joke_data.get('emoji', ''),
-                    'created_by_customer': False,
-                    'creator_id': creator_id,
-                    'created_at': datetime.utcnow(),
-                    'random_val': random.random()
-                }
+        def _build_write(joke_data: dict, existing_doc_ref=None, existing_data: Optional[Dict] = None):
+            """Return the (doc_ref, data, mode) write that saves one joke, or None if it's already saved"""
+            joke_setup = joke_data.get('joke_setup', '')
+            joke_punchline = joke_data.get('joke_punchline', '')
+            new_scenarios = joke_data.get('scenarios', [])
+            new_age_range = joke_data.get('age_range', [])
+            
+            # An existing joke may project to an empty dict (no scenarios or age_range yet)
+            if existing_doc_ref is not None and existing_data is not None:
+                # Joke exists - merge age_range and scenarios
+                existing_scenarios = existing_data.get('scenarios') or []
+                existing_age_range = existing_data.get('age_range') or []
+                added_scenarios = [v for v in new_scenarios or [] if v not in existing_scenarios]
+                added_age_range = [v for v in new_age_range or [] if v not in existing_age_range]
                 
-                # If joke_id is provided, use it; otherwise let Firestore generate one
-                joke_id = joke_data.get('joke_id', '')
-                if joke_id:
-                    # Use the provided joke_id
-                    doc_ref = db.collection('jokes').document(joke_id)
-                    doc_ref.set(joke_doc)
-                else:
-                    # Let Firestore generate the ID
-                    db.collection('jokes').add(joke_doc)
+                # Nothing new to merge - skip the write
+                if not added_scenarios and not added_age_range:
+                    return None
                 
-                saved_count += 1
+                # ArrayUnion merges server-side, so concurrent saves of the same joke don't drop values
+                return existing_doc_ref, {
+                    'scenarios': ArrayUnion(added_scenarios),
+                    'age_range': ArrayUnion(added_age_range),
+                    FILTER_KEYS_FIELD: _filter_keys(existing_scenarios + added_scenarios, existing_age_range + added_age_range)
+                }, 'update'
+            
+            # Joke doesn't exist - create new joke document
+            joke_doc = {
+                'joke_setup': joke_setup,
+                'joke_punchline': joke_punchline,
+                'joke_punchline_lower': joke_punchline.strip().lower(),
+                'joke_content': joke_data.get('joke_content', ''),
+                'default_audio_url': joke_data.get('default_audio_url', ''),
+                'audio_urls': joke_data.get('audio_urls', []),
+                'scenarios': new_scenarios,
+                'age_range': new_age_range,
+                FILTER_KEYS_FIELD: _filter_keys(new_scenarios, new_age_range),
+                'emoji': joke_data.get('emoji', ''),
+                'created_by_customer': False,
+                'creator_id': creator_id,
+                'created_at': SERVER_TIMESTAMP,
+                'random_val': random.random()
+            }
+            
+            # If joke_id is provided, use it; otherwise derive it from the joke's content
+            joke_id = joke_data.get('joke_id', '') or FirebaseService.content_joke_id(joke_setup, joke_punchline)
+            doc_ref = _jokes_ref().document(joke_id)
+            # create() never replaces a stored joke; one saved concurrently is merged into instead
+            return doc_ref, joke_doc, 'create'
+        
+        def _commit_one(joke_data: dict, write: tuple) -> int:
+            """Commit a single write, merging into the joke if it was created since it was looked up"""
+            doc_ref, data, mode = write
+            try:
+                getattr(doc_ref, mode)(data, retry=WRITE_RETRY)
+                return 1
+            except AlreadyExists:
+                snapshot = doc_ref.get(field_paths=['scenarios', 'age_range'])
+                if not snapshot.exists:
+                    # Deleted again since the create failed: nothing to merge into
+                    raise
+                merge = _build_write(joke_data, doc_ref, snapshot.to_dict() or {})
+                if not merge:
+                    return 0
+                merge[0].update(merge[1], retry=WRITE_RETRY)
+                return 1
+        
+        def _commit(writes: list) -> int:
+            try:
+                batch = db.batch()
+                for _, (doc_ref, data, mode) in writes:
+                    getattr(batch, mode)(doc_ref, data)
+                batch.commit(retry=WRITE_RETRY)
+                return len(writes)
+            except AlreadyExists:
+                # A joke in this batch was saved concurrently: commit the writes one by one
+                saved = 0
+                for joke_data, write in writes:
+                    try:
+                        saved += _commit_one(joke_data, write)
+                    except Exception as e:
+                        print(f"Error saving joke: {str(e)}")
+                return saved
+            except Exception as e:
+                print(f"Error saving batch of {len(writes)} jokes: {str(e)}")
+                return 0
+        
+        # Collapse duplicates within the batch first so one WriteBatch never touches a joke twice
+        unique_jokes = {}
+        for joke_data in jokes:
+            key = FirebaseService._joke_key(joke_data.get('joke_setup', ''), joke_data.get('joke_punchline', ''))
+            if key in unique_jokes:
+                merged = unique_jokes[key]
+                merged['scenarios'] = list(dict.fromkeys((merged.get('scenarios') or []) + (joke_data.get('scenarios') or [])))
+                merged['age_range'] = list(dict.fromkeys((merged.get('age_range') or []) + (joke_data.get('age_range') or [])))
+            else:
+                unique_jokes[key] = dict(joke_data)
+        
+        pending = list(unique_jokes.values())
+        if not pending:
+            return 0
+        
+        # Look up all existing duplicates up front instead of one setup query per joke
+        existing = FirebaseService._get_existing_joke_docs(
+            [(j.get('joke_setup', ''), j.get('joke_punchline', '')) for j in pending]
+        )
+        
+        writes = []
+        for key, joke_data in unique_jokes.items():
+            try:
+                write = _build_write(joke_data, *existing.get(key, (None, None)))
+                if write:
+                    writes.append((joke_data, write))
             except Exception as e:
                 print(f"Error saving joke: {str(e)}")
-                continue
         
-        print(f"Saved {saved_count} new jokes to database")
+        # Commit many jokes per RPC; independent chunks are committed concurrently
+        chunks = [writes[i:i + SAVE_JOKES_BATCH_SIZE] for i in range(0, len(writes), SAVE_JOKES_BATCH_SIZE)]
+        if len(chunks) <= 1:
+            saved_count = sum(_commit(chunk) for chunk in chunks)
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(chunks), SAVE_JOKES_MAX_WORKERS)) as executor:
+                saved_count = sum(executor.map(_commit, chunks))
+        
+        if saved_count:
+            _invalidate_jokes_cache()
+            _invalidate_joke_cache(*(doc_ref.id for _, (doc_ref, _, _) in writes))
+        merged_count = sum(1 for _, (_, _, mode) in writes if mode == 'update')
+        print(f"Saved {saved_count} jokes to database ({len(writes) - merged_count} new, {merged_count} merged into existing jokes)")
         return saved_count
     
     @staticmethod
     def get_disliked_jokes(user_id: str) -> List[JokeResponse]:
         """Get all disliked jokes for a user"""
+        return FirebaseService._get_user_list_jokes(user_id, 'dislike_history')
+
+    @staticmethod
+    def migrate_add_random_val() -> Dict[str, int]:
+        """
+        Migration function to add random_val to all jokes that don't have it.
+        Returns a dictionary with statistics about the migration.
+        """
         db = _get_db()
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        jokes_ref = _jokes_ref()
+        # Only random_val is needed to decide whether a joke needs migrating
+        docs = jokes_ref.select(['random_val']).stream()
         
-        if not user_doc.exists:
-            return []
+        updated_count = 0
+        skipped_count = 0
+        error_count = 0
         
-        user_data = user_doc.to_dict()
-        disliked_ids = user_data.get('dislike_history', [])
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting migration to add random_val to jokes...")
         
-        if not disliked_ids:
-            return []
+        def _commit(batch, pending: int):
+            nonlocal updated_count, error_count
+            try:
+                batch.commit(retry=WRITE_RETRY)
+                updated_count += pending
+                print(f"Migrated {updated_count} jokes so far...")
+            except Exception as e:
+                print(f"Error updating batch of {pending} jokes: {str(e)}")
+                error_count += pending
         
-        # Get all jokes that are in dislike_history
-        jokes = []
-        for joke_id in disliked_ids:
-            joke_ref = db.collection('jokes').document(joke_id)
-            joke_doc = joke_ref.get()
+        # Updates are committed SAVE_JOKES_BATCH_SIZE at a time instead of one RPC per joke
+        batch = db.batch()
+        pending = 0
+        for doc in docs:
+            data = doc.to_dict()
             
-            if joke_doc.exists:
-                data = joke_doc.to_dict()
-                # Convert Firestore timestamp to datetime if needed
-                created_at = data.get('created_at')
-                if hasattr(created_at, 'timestamp'):
-                    created_at = datetime.fromtimestamp(created_at.timestamp())
-                
-                joke = JokeResponse(
-                    joke_id=joke_doc.id,
-                    joke_setup=data.get('joke_setup', ''),
-                    joke_punchline=data.get('joke_punchline', ''),
-                    joke_content=data.get('joke_content', ''),
-                    default_audio_id=data.get('default_audio_id', ''),
-                    audio_ids=data.get('audio_ids', []),
-                    scenarios=data.get('scenarios', []),
-                    age_range=data.get('age_range', data.get('ages', [])),  # Support both old and new field names
-                    emoji=data.get('emoji', ''),
-                    created_by_customer=data.get('created_by_customer', False),
-                    creator_id=data.get('creator_id', ''),
-                    created_at=created_at,
-                    random_val=data.get('random_val')
-                )
-                jokes.append(joke)
+            # Check if random_val already exists
+            if data.get('random_val') is not None:
+                skipped_count += 1
+                continue
+            
+            # Add random_val
+            batch.update(doc.reference, {'random_val': random.random()})
+            pending += 1
+            if pending == SAVE_JOKES_BATCH_SIZE:
+                _commit(batch, pending)
+                batch = db.batch()
+                pending = 0
         
-        return jokes
+        if pending:
+            _commit(batch, pending)
+        
+        result = {
+            'updated': updated_count,
+            'skipped': skipped_count,
+            'errors': error_count,
+            'total_processed': updated_count + skipped_count + error_count
+        }
+        
+        print(f"Migration completed: {result}")
+        return result
     
     @staticmethod
-    def migrate_add_random_val() -> Dict[str, int]:
+    def migrate_add_punchline_lower() -> Dict[str, int]:
         """
-        Migration function to add random_val to all jokes that don't have it.
+        Migration function to add joke_punchline_lower to all jokes that don't have it.
+        Duplicate lookups match on this field, so older jokes need it to be found.
         Returns a dictionary with statistics about the migration.
         """
         db = _get_db()
-        jokes_ref = db.collection('jokes')
-        docs = jokes_ref.stream()
+        docs = _jokes_ref().select(['joke_punchline', 'joke_punchline_lower']).stream()
         
         updated_count = 0
         skipped_count = 0
         error_count = 0
         
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting migration to add random_val to jokes...")
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting migration to add joke_punchline_lower to jokes...")
+        
+        def _commit(batch, pending: int):
+            nonlocal updated_count, error_count
+            try:
+                batch.commit(retry=WRITE_RETRY)
+                updated_count += pending
+                print(f"Migrated {updated_count} jokes so far...")
+            except Exception as e:
+                print(f"Error updating batch of {pending} jokes: {str(e)}")
+                error_count += pending
         
+        batch = db.batch()
+        pending = 0
         for doc in docs:
+            data = doc.to_dict()
+            
+            # Check if joke_punchline_lower already exists
+            if data.get('joke_punchline_lower') is not None:
+                skipped_count += 1
+                continue
+            
+            batch.update(doc.reference, {'joke_punchline_lower': data.get('joke_punchline', '').strip().lower()})
+            pending += 1
+            if pending == SAVE_JOKES_BATCH_SIZE:
+                _commit(batch, pending)
+                batch = db.batch()
+                pending = 0
+        
+        if pending:
+            _commit(batch, pending)
+        
+        result = {
+            'updated': updated_count,
+            'skipped': skipped_count,
+            'errors': error_count,
+            'total_processed': updated_count + skipped_count + error_count
+        }
+        
+        print(f"Migration completed: {result}")
+        return result
+    
+    @staticmethod
+    def migrate_add_filter_keys() -> Dict[str, int]:
+        """
+        Migration function to add filter_keys to all jokes that don't have it.
+        get_random_jokes filters on this field, so older jokes need it to match a scenario or age_range.
+        Returns a dictionary with statistics about the migration.
+        """
+        db = _get_db()
+        docs = _jokes_ref().select(['scenarios', 'age_range', 'ages', FILTER_KEYS_FIELD]).stream()
+        
+        updated_count = 0
+        skipped_count = 0
+        error_count = 0
+        
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting migration to add filter_keys to jokes...")
+        
+        def _commit(batch, pending: int):
+            nonlocal updated_count, error_count
             try:
-                data = doc.to_dict()
-                
-                # Check if random_val already exists
-                if 'random_val' in data and data['random_val'] is not None:
-                    skipped_count += 1
-                    continue
-                
-                # Add random_val
-                random_value = random.random()
-                doc.reference.update({'random_val': random_value})
-                updated_count += 1
-                
-                if updated_count % 100 == 0:
-                    print(f"Migrated {updated_count} jokes so far...")
-                    
+                batch.commit(retry=WRITE_RETRY)
+                updated_count += pending
+                print(f"Migrated {updated_count} jokes so far...")
             except Exception as e:
-                print(f"Error updating joke {doc.id}: {str(e)}")
-                error_count += 1
+                print(f"Error updating batch of {pending} jokes: {str(e)}")
+                error_count += pending
+        
+        batch = db.batch()
+        pending = 0
+        for doc in docs:
+            data = doc.to_dict()
+            
+            # Check if filter_keys already exists
+            if data.get(FILTER_KEYS_FIELD) is not None:
+                skipped_count += 1
                 continue
+            
+            keys = _filter_keys(data.get('scenarios'), data.get('age_range') or data.get('ages'))
+            batch.update(doc.reference, {FILTER_KEYS_FIELD: keys})
+            pending += 1
+            if pending == SAVE_JOKES_BATCH_SIZE:
+                _commit(batch, pending)
+                batch = db.batch()
+                pending = 0
+        
+        if pending:
+            _commit(batch, pending)
         
         result = {
             'updated': updated_count,
@@ -961,21 +1461,16 @@ class FirebaseService:
             is_default: If True, update default_audio_url in the joke document. Defaults to True.
         """
         try:
-            db = _get_db()
-            joke_ref = db.collection('jokes').document(joke_id)
+            joke_ref = _jokes_ref().document(joke_id)
             
             # Always add audio_url to audio_urls array as a map of voice_id to audio_url
             audio_entry = {"voice_id": voice_id, "audio_url": audio_url}
-            joke_ref.update({
-                'audio_urls': ArrayUnion([audio_entry])
-            })
+            joke_update = {'audio_urls': ArrayUnion([audio_entry])}
             
             # Update the joke document with default_audio_url only if is_default is True
             if is_default:
-                joke_ref.update({
-                    'default_audio_url': audio_url
-                })
-           
+                joke_update['default_audio_url'] = audio_url
+            
             # Insert/update entry in joke_audios collection (always save)
             # Document ID: joke_id_voice_id if voice_id exists and is not "default", otherwise use joke_id
             if voice_id and voice_id != "default" and voice_id.strip():
@@ -983,14 +1478,20 @@ class FirebaseService:
             else:
                 doc_id = joke_id
             
-            db.collection('joke_audios').document(doc_id).set({
+            # Both documents are written in one commit instead of up to three sequential RPCs
+            batch = _get_db().batch()
+            batch.update(joke_ref, joke_update)
+            batch.set(_joke_audios_ref().document(doc_id), {
                 'joke_id': joke_id,
                 'audio_url': audio_url,
                 'audio_size': audio_size,
                 'voice_id': voice_id,
                 'elevenlabs_voice_id': elevenlabs_voice_id,
-                'created_at': datetime.utcnow()
+                'created_at': SERVER_TIMESTAMP
             }, merge=True)
+            batch.commit(retry=WRITE_RETRY)
+            _invalidate_jokes_cache()
+            _invalidate_joke_cache(joke_id)
         except Exception as e:
             print(f"Error saving audio URL asynchronously for joke {joke_id}: {str(e)}")
     
@@ -1011,11 +1512,9 @@ class FirebaseService:
             bucket = get_storage_bucket()
             blob = bucket.blob(file_path)
             
-            # Upload the file
-            blob.upload_from_string(file_data, content_type=content_type)
-            
-            # Make the file publicly accessible
-            blob.make_public()
+            # Upload the file, publicly readable through the upload's ACL
+            # instead of a separate make_public() request
+            blob.upload_from_string(file_data, content_type=content_type, predefined_acl='publicRead')
             
             # Get the public URL and file size
             audio_url = blob.public_url
@@ -1039,7 +1538,6 @@ class FirebaseService:
             Optional[str]: The audio URL if found, None otherwise
         """
         try:
-            db = _get_db()
             # Document ID: joke_id_voice_id if voice_id exists and is not "default", otherwise use joke_id
             if voice_id and voice_id != "default" and voice_id.strip():
                 doc_id = f"{joke_id}_{voice_id}"
@@ -1047,7 +1545,7 @@ class FirebaseService:
                 doc_id = joke_id
             
             # Get document directly by ID (more efficient than querying)
-            doc = db.collection('joke_audios').document(doc_id).get()
+            doc = _joke_audios_ref().document(doc_id).get()
             
             if doc.exists:
                 data = doc.to_dict()
@@ -1071,8 +1569,7 @@ class FirebaseService:
             Optional[Dict]: Voice data including voice_url, or None if not found
         """
         try:
-            db = _get_db()
-            voice_doc = db.collection('voices').document(voice_id).get()
+            voice_doc = _voices_ref().document(voice_id).get()
             
             if voice_doc.exists:
                 return voice_doc.to_dict()
@@ -1081,6 +1578,46 @@ class FirebaseService:
             print(f"Error getting voice {voice_id}: {str(e)}")
             return None
     
+    @staticmethod
+    def get_cached_elevenlabs_voice_id(cache_key: str) -> Optional[str]:
+        """
+        Get a previously cloned ElevenLabs voice_id from the voice_cache collection.
+        
+        Args:
+            cache_key: sha256 hex digest of the Firebase voice URL
+        
+        Returns:
+            Optional[str]: The ElevenLabs voice_id if cached, None otherwise
+        """
+        try:
+            doc = _voice_cache_ref().document(cache_key).get()
+            
+            if doc.exists:
+                return doc.to_dict().get('elevenlabs_voice_id')
+            return None
+        except Exception as e:
+            print(f"Error getting cached ElevenLabs voice {cache_key}: {str(e)}")
+            return None
+    
+    @staticmethod
+    def save_cached_elevenlabs_voice_id(cache_key: str, elevenlabs_voice_id: str, voice_url: str):
+        """
+        Save the ElevenLabs voice_id cloned from a Firebase voice URL to the voice_cache collection.
+        
+        Args:
+            cache_key: sha256 hex digest of the Firebase voice URL
+            elevenlabs_voice_id: The ElevenLabs voice_id returned by cloning
+            voice_url: The Firebase voice URL that was cloned
+        """
+        try:
+            _voice_cache_ref().document(cache_key).set({
+                'elevenlabs_voice_id': elevenlabs_voice_id,
+                'voice_url': voice_url,
+                'created_at': SERVER_TIMESTAMP
+            })
+        except Exception as e:
+            print(f"Error saving cached ElevenLabs voice {cache_key}: {str(e)}")
+    
     @staticmethod
     def get_user_voices(user_id: str) -> List[Dict[str, str]]:
         """
@@ -1093,9 +1630,8 @@ class FirebaseService:
             List[Dict[str, str]]: List of dictionaries with 'voice_id' and 'voice_name' keys
         """
         try:
-            db = _get_db()
-            user_ref = db.collection('users').document(user_id)
-            user_doc = user_ref.get()
+            user_ref = _users_ref().document(user_id)
+            user_doc = user_ref.get(field_paths=['voices'])
             
             if not user_doc.exists:
                 return []
@@ -1137,8 +1673,6 @@ class FirebaseService:
         Returns:
             Dict containing the voice data
         """
-        db = _get_db()
-        
         # Prepare voice data
         voice_data = {
             'voice_id': voice_id,
@@ -1148,39 +1682,47 @@ class FirebaseService:
             'created_at': datetime.utcnow()
         }
         
-        # Save to voices collection (use voice_id as document ID)
-        db.collection('voices').document(voice_id).set(voice_data)
+        user_ref = _users_ref().document(creator_id)
+        user_doc = user_ref.get(field_paths=['voices'])
         
-        # Update user's voices array
-        user_ref = db.collection('users').document(creator_id)
-        user_doc = user_ref.get()
+        # Save the voice and update the user's voices array in one commit
+        batch = _get_db().batch()
+        
+        # Save to voices collection (use voice_id as document ID)
+        batch.set(_voices_ref().document(voice_id), voice_data)
         
         if not user_doc.exists:
             # Create user document if it doesn't exist
-            user_data = {
-                'user_display_name': '',
-                'user_email': '',
-                'country': '',
-                'favorites': [],
-                'like_history': [],
-                'dislike_history': [],
-                'creation_history': [],
-                'joke_jar': [],
-                'voices': [voice_id],
-                'settings': {},
-                'age_range': '',
-                'scenario': '',
-                'voice_to_use': '',
-                'created_at': datetime.utcnow()
-            }
-            user_ref.set(user_data)
+            user_data = _new_user_doc(voices=[voice_id])
+            batch.set(user_ref, user_data)
         else:
             # Update existing user document - add voice_id to voices array using ArrayUnion to avoid duplicates
-            user_ref.update({
+            batch.update(user_ref, {
                 'voices': ArrayUnion([voice_id])
             })
         
-            return voice_data
+        batch.commit()
+        return voice_data
+    
+    @staticmethod
+    def flush_queued_writes(timeout: float = 5.0) -> bool:
+        """
+        Wait for queued background writes to be committed and write pending counter deltas.
+        Called on application shutdown.
+        
+        Args:
+            timeout: Maximum number of seconds to wait
+        
+        Returns:
+            bool: True if the queue was drained, False if the timeout was reached
+        """
+        deadline = time.monotonic() + timeout
+        while _write_queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(WRITE_BATCH_WINDOW)
+        _flush_counters()
+        return True
     
     @staticmethod
     def add_to_history(creator_id: str, joke_id: str) -> bool:
@@ -1192,37 +1734,27 @@ class FirebaseService:
             joke_id: ID of the joke to add to joke_jar
         
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if the write was made or queued, False otherwise.
+            A queued write is committed in the background; a failed commit is only logged.
         """
         try:
-            db = _get_db()
-            user_ref = db.collection('users').document(creator_id)
-            user_doc = user_ref.get()
+            user_ref = _users_ref().document(creator_id)
+            user_doc = user_ref.get(field_paths=['joke_jar'])
             
             if not user_doc.exists:
                 # Create user document if it doesn't exist
-                user_data = {
-                    'user_display_name': '',
-                    'user_email': '',
-                    'country': '',
-                    'favorites': [],
-                    'like_history': [],
-                    'dislike_history': [],
-                    'creation_history': [],
-                    'joke_jar': [joke_id],
-                    'voices': [],
-                    'settings': {},
-                    'age_range': '',
-                    'scenario': '',
-                    'voice_to_use': '',
-                    'created_at': datetime.utcnow()
-                }
+                user_data = _new_user_doc(joke_jar=[joke_id])
                 user_ref.set(user_data)
             else:
-                # Update existing user document - add joke_id to joke_jar array using ArrayUnion
-                user_ref.update({
-                    'joke_jar': ArrayUnion([joke_id])
-                })
+                # Update existing user document - add joke_id to joke_jar array using ArrayUnion.
+                # Queued so bursts of history writes are committed together in one batch; the cached
+                # joke IDs are dropped only after the commit, so a read in between can't re-cache the old jar
+                _enqueue_write(
+                    user_ref, {'joke_jar': ArrayUnion([joke_id])},
+                    on_commit=functools.partial(_invalidate_user_jokes_cache, creator_id)
+                )
+                return True
+            _invalidate_user_jokes_cache(creator_id)
             
             return True
         except Exception as e:
@@ -3,19 +3,69 @@ from google.genai import types
 from typing import List, Optional, Tuple
 from models import GeminiJokeItem
 from firebase.config import GEMINI_API_KEY
-from firebase.firebase_init import get_firestore
 from firebase_service import FirebaseService
 from datetime import datetime
-import json
-import re
+import asyncio
+import functools
 import base64
-import wave
-import io
+import struct
+import weakref
+
+# RIFF/WAVE header for the raw PCM returned by Gemini TTS
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+# Maximum number of emoji requests made at once for one batch of jokes
+EMOJI_CONCURRENCY = 8
+
+# Base prompt for generate_jokes; the LIKED/DISLIKED sections are appended after it
+JOKES_PROMPT = """Generate exactly {num_jokes} jokes that are appropriate for age range {age_range} and scenario "{scenario}".
+
+For each joke, provide:
+1. A setup (the question or statement that sets up the joke)
+2. A punchline (the funny answer or conclusion)
+3. Optional additional context (can be empty string)
+4. A single emoji that best represents or relates to the joke
+
+Make sure the jokes are:
+- Age-appropriate for {age_range}
+- Related to the scenario: {scenario}
+- Clean and family-friendly
+- Funny and engaging"""
+
+LIKED_JOKES_CONTEXT = "\n\nUser's LIKED jokes (generate jokes in a similar style and humor):\n{examples}"
+DISLIKED_JOKES_CONTEXT = "\n\nUser's DISLIKED jokes (avoid generating jokes with similar style, topics, or humor):\n{examples}"
+
+# Number of liked/disliked jokes shown to Gemini as examples
+MAX_PREFERENCE_EXAMPLES = 5
+
+@functools.lru_cache(maxsize=256)
+def _base_prompt(age_range: str, scenario: str, num_jokes: int) -> str:
+    """Build the preference-free part of the jokes prompt, cached per (age_range, scenario, num_jokes)"""
+    return JOKES_PROMPT.format(num_jokes=num_jokes, age_range=age_range, scenario=scenario)
+
+def _format_joke_examples(jokes: List[dict]) -> str:
+    """Format up to MAX_PREFERENCE_EXAMPLES jokes as prompt example lines"""
+    return "\n".join(
+        f"- Setup: \"{j.get('joke_setup', '')}\" Punchline: \"{j.get('joke_punchline', '')}\""
+        for j in jokes[:MAX_PREFERENCE_EXAMPLES]
+    )
 
 class GeminiService:
+    # Shared Gemini clients, so calls reuse connections instead of setting up new ones. One per
+    # event loop, since client.aio binds its transport to the loop it first runs on
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, genai.Client]" = weakref.WeakKeyDictionary()
+    
+    @classmethod
+    def _get_client(cls) -> genai.Client:
+        """Get the Gemini client of the running event loop, creating it lazily on first use"""
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None:
+            client = cls._clients[loop] = genai.Client(api_key=GEMINI_API_KEY)
+        return client
     
     @staticmethod
-    def generate_emoji_for_joke(joke_id: str, setup: str, punchline: str) -> Optional[str]:
+    async def generate_emoji_for_joke_async(joke_id: str, setup: str, punchline: str) -> Optional[str]:
         """
         Generate an emoji for a joke using Gemini AI.
         
@@ -31,8 +81,8 @@ class GeminiService:
             return None
         
         try:
-            # Create Gemini client
-            client = genai.Client(api_key=GEMINI_API_KEY)
+            # Get the shared Gemini client
+            client = GeminiService._get_client()
             
             # Create a simple prompt to generate an emoji
             prompt = f"""Given this joke, return a single emoji that best represents or relates to the joke.
@@ -43,25 +93,13 @@ Joke Punchline: {punchline}
 Return ONLY a single emoji character (no text, no explanation, just the emoji)."""
 
             # Generate content
-            response = client.models.generate_content(
+            response = await client.aio.models.generate_content(
                 model='gemini-2.5-flash',
                 contents=prompt
             )
             
-            # Extract emoji from response
-            if not response.candidates or len(response.candidates) == 0:
-                return None
-            
-            candidate = response.candidates[0]
-            if not candidate.content or not candidate.content.parts:
-                return None
-            
-            # Get text from the first part
-            emoji_text = ""
-            for part in candidate.content.parts:
-                if hasattr(part, 'text') and part.text:
-                    emoji_text = part.text.strip()
-                    break
+            # Extract emoji from response (response.text is None when there is no text part)
+            emoji_text = (response.text or "").strip()
             
             if not emoji_text:
                 return None
@@ -77,7 +115,7 @@ Return ONLY a single emoji character (no text, no explanation, just the emoji)."
             return None
     
     @staticmethod
-    def generate_jokes(
+    async def generate_jokes_async(
         age_range: str, 
         scenario: str, 
         num_jokes: int = 10,
@@ -100,184 +138,65 @@ Return ONLY a single emoji character (no text, no explanation, just the emoji)."
         if not GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY is not set in environment variables")
         
-        # Create Gemini client
-        client = genai.Client(api_key=GEMINI_API_KEY)
+        # Get the shared Gemini client
+        client = GeminiService._get_client()
 
         # Note: Model listing code removed - this was likely for debugging
 
         # Build preference context
         preference_context = ""
         if liked_jokes and len(liked_jokes) > 0:
-            liked_examples = "\n".join([
-                f"- Setup: \"{j.get('joke_setup', '')}\" Punchline: \"{j.get('joke_punchline', '')}\""
-                for j in liked_jokes[:5]  # Use up to 5 examples
-            ])
-            preference_context += f"\n\nUser's LIKED jokes (generate jokes in a similar style and humor):\n{liked_examples}"
+            preference_context += LIKED_JOKES_CONTEXT.format(examples=_format_joke_examples(liked_jokes))
         
         if disliked_jokes and len(disliked_jokes) > 0:
-            disliked_examples = "\n".join([
-                f"- Setup: \"{j.get('joke_setup', '')}\" Punchline: \"{j.get('joke_punchline', '')}\""
-                for j in disliked_jokes[:5]  # Use up to 5 examples
-            ])
-            preference_context += f"\n\nUser's DISLIKED jokes (avoid generating jokes with similar style, topics, or humor):\n{disliked_examples}"
+            preference_context += DISLIKED_JOKES_CONTEXT.format(examples=_format_joke_examples(disliked_jokes))
         
         # Create the prompt
-        prompt = f"""Generate exactly {num_jokes} jokes that are appropriate for age range {age_range} and scenario "{scenario}".
-
-For each joke, provide:
-1. A setup (the question or statement that sets up the joke)
-2. A punchline (the funny answer or conclusion)
-
-Format the response as a JSON array where each joke has:
-- "joke_setup": the setup text
-- "joke_punchline": the punchline text
-- "joke_content": optional additional context (can be empty string)
-
-Example format:
-[
-  {{
-    "joke_setup": "Why did the chicken cross the playground?",
-    "joke_punchline": "To get to the other slide!",
-    "joke_content": ""
-  }},
-  {{
-    "joke_setup": "What do you call a sleeping bull?",
-    "joke_punchline": "A bulldozer!",
-    "joke_content": ""
-  }}
-]
-
-Make sure the jokes are:
-- Age-appropriate for {age_range}
-- Related to the scenario: {scenario}
-- Clean and family-friendly
-- Funny and engaging{preference_context}
-
-Return ONLY the JSON array, no additional text or explanation."""
+        prompt = _base_prompt(age_range, scenario, num_jokes) + preference_context
 
         try:
-            # Generate content
-            response = client.models.generate_content(
+            # Generate content; structured output makes Gemini return JSON matching the schema,
+            # which the SDK parses into GeminiJokeItem objects
+            response = await client.aio.models.generate_content(
                 model='gemini-2.5-flash',
-                contents=prompt
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type='application/json',
+                    response_schema=list[GeminiJokeItem]
+                )
             )
             
-            # Extract JSON from response
-            # In the new API, text is accessed via candidates[0].content.parts[0].text
-            if not response.candidates or len(response.candidates) == 0:
-                raise ValueError("No response candidates from Gemini")
-            
-            candidate = response.candidates[0]
-            if not candidate.content or not candidate.content.parts:
-                raise ValueError("No content parts in response")
-            
-            # Get text from the first part
-            response_text = ""
-            for part in candidate.content.parts:
-                if hasattr(part, 'text') and part.text:
-                    response_text = part.text
-                    break
-            
-            if not response_text:
-                raise ValueError("No text found in response")
+            jokes_data = response.parsed
+            if jokes_data is None:
+                response_text = response.text or ""
+                print(f"Structured output parsing failed. Response text: {response_text[:500] if response_text else 'No response'}")
+                raise ValueError("Failed to parse Gemini response as jokes")
             
-            response_text = response_text.strip()
+            # The SDK already validated these into GeminiJokeItem objects, so they are reused as is
+            jokes = list(jokes_data)
+            for joke in jokes:
+                joke.joke_content = joke.joke_content or ""
+                joke.emoji = joke.emoji or ""
+            return await GeminiService._add_missing_emojis(jokes)
             
-            # Remove markdown code blocks if present
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            elif response_text.startswith("```"):
-                response_text = response_text[3:]
-            
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            
-            response_text = response_text.strip()
-            
-            # Parse JSON
-            jokes_data = json.loads(response_text)
-            
-            # Convert to GeminiJokeItem objects and generate emoji for each joke
-            jokes = []
-            for joke_data in jokes_data:
-                joke_setup = joke_data.get("joke_setup", "")
-                joke_punchline = joke_data.get("joke_punchline", "")
-                joke_content = joke_data.get("joke_content", "")
-                
-                # Generate emoji for the joke
-                emoji = GeminiService.generate_emoji_for_joke("", joke_setup, joke_punchline)
-                
-                jokes.append(GeminiJokeItem(
-                    joke_setup=joke_setup,
-                    joke_punchline=joke_punchline,
-                    joke_content=joke_content,
-                    emoji=emoji or ""
-                ))
-            
-            return jokes
-            
-        except json.JSONDecodeError as e:
-            # If JSON parsing fails, try to extract jokes manually
-            response_text = ""
-            if 'response' in locals() and response:
-                try:
-                    if response.candidates and len(response.candidates) > 0:
-                        candidate = response.candidates[0]
-                        if candidate.content and candidate.content.parts:
-                            for part in candidate.content.parts:
-                                if hasattr(part, 'text') and part.text:
-                                    response_text = part.text
-                                    break
-                except:
-                    pass
-            print(f"JSON parsing failed: {e}")
-            print(f"Response text: {response_text[:500] if response_text else 'No response'}")
-            
-            # Try to extract jokes using regex as fallback
-            if response_text:
-                jokes = GeminiService._extract_jokes_from_text(response_text)
-                if jokes:
-                    return jokes
-            
-            raise ValueError(f"Failed to parse Gemini response as JSON: {str(e)}")
         except Exception as e:
             raise ValueError(f"Error generating jokes with Gemini: {str(e)}")
     
     @staticmethod
-    def _extract_jokes_from_text(text: str) -> List[GeminiJokeItem]:
-        """
-        Fallback method to extract jokes from text if JSON parsing fails
-        """
-        jokes = []
-        lines = text.split('\n')
+    async def _add_missing_emojis(jokes: List[GeminiJokeItem]) -> List[GeminiJokeItem]:
+        """Generate an emoji for every joke without one, EMOJI_CONCURRENCY requests at a time"""
+        semaphore = asyncio.Semaphore(EMOJI_CONCURRENCY)
         
-        current_setup = None
-        current_punchline = None
+        async def add_emoji(joke: GeminiJokeItem):
+            async with semaphore:
+                emoji = await GeminiService.generate_emoji_for_joke_async("", joke.joke_setup, joke.joke_punchline)
+            joke.emoji = emoji or ""
         
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Look for setup patterns
-            if any(keyword in line.lower() for keyword in ['why', 'what', 'how', 'when', 'where', 'did', 'do', 'does']):
-                if current_setup and current_punchline:
-                    emoji = GeminiService.generate_emoji_for_joke("", current_setup, current_punchline)
-                    jokes.append(GeminiJokeItem(
-                        joke_setup=current_setup,
-                        joke_punchline=current_punchline,
-                        joke_content="",
-                        emoji=emoji or ""
-                    ))
-                current_setup = line
-                current_punchline = None
-            elif current_setup and not current_punchline:
-                current_punchline = line
-        
-        return jokes[:10]  # Return up to 10 jokes
+        await asyncio.gather(*(add_emoji(joke) for joke in jokes if not joke.emoji))
+        return jokes
     
     @staticmethod
-    def generate_audio_for_joke(joke_id: str, setup: str, punchline: str) -> Optional[Tuple[str, int]]:
+    async def generate_audio_for_joke_async(joke_id: str, setup: str, punchline: str) -> Optional[Tuple[str, int]]:
         """
         Generate audio for a joke using Gemini's TTS model, upload to Firebase Storage,
         and save to database. Returns the audio URL and size.
@@ -294,8 +213,8 @@ Return ONLY the JSON array, no additional text or explanation."""
             if not GEMINI_API_KEY:
                 raise ValueError("GEMINI_API_KEY is not set in environment variables")
             
-            # Create Gemini client
-            client = genai.Client(api_key=GEMINI_API_KEY)
+            # Get the shared Gemini client
+            client = GeminiService._get_client()
 
             # Use the most basic config possible to ensure the SDK doesn't block it
             joke_config = {
@@ -319,7 +238,7 @@ Return ONLY the JSON array, no additional text or explanation."""
             """
 
             print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Gemini start generate content for joke {joke_id}")
-            response = client.models.generate_content(
+            response = await client.aio.models.generate_content(
                 model="gemini-2.5-flash-preview-tts",
                 contents=audio_prompt,
                 config=joke_config
@@ -382,7 +301,10 @@ Return ONLY the JSON array, no additional text or explanation."""
             
             # Upload to Firebase Storage bucket using FirebaseService
             file_path = f"jokes_audio/{joke_id}/default.wav"
-            audio_url, audio_size = FirebaseService.save_to_bucket(file_path, wav_audio, content_type='audio/wav')
+            # The Storage upload is blocking, so it runs in a worker thread
+            audio_url, audio_size = await asyncio.to_thread(
+                FirebaseService.save_to_bucket, file_path, wav_audio, content_type='audio/wav'
+            )
             
             return audio_url, audio_size
             
@@ -398,10 +320,12 @@ Return ONLY the JSON array, no additional text or explanation."""
         Convert PCM audio data to WAV format.
         Gemini 2.5 TTS default: 24000Hz, 16-bit, Mono
         """
-        with io.BytesIO() as wav_file:
-            with wave.open(wav_file, 'wb') as wf:
-                wf.setnchannels(1)          # Mono
-                wf.setsampwidth(2)          # 16-bit (2 bytes)
-                wf.setframerate(24000)      # 24kHz
-                wf.writeframes(pcm_data)
-            return wav_file.getvalue()
+        sample_rate, channels, sample_width = 24000, 1, 2
+        data_size = len(pcm_data)
+        header = WAV_HEADER.pack(
+            b'RIFF', 36 + data_size, b'WAVE',
+            b'fmt ', 16, 1, channels, sample_rate,
+            sample_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+            b'data', data_size
+        )
+        return header + pcm_data
@@ -4,19 +4,14 @@ from fastapi.staticfiles import StaticFiles
 from firebase.firebase_init import initialize_firebase
 from routes import router
 from firebase_service import FirebaseService
+from elevenlabs_service import ElevenlabsService
+from firebase.config import LOG_LEVEL
+import asyncio
+import logging
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
 
-# Initialize Firebase
 print("--- Starting API ---")
-try:
-    initialize_firebase()
-    print("--- Firebase Initialized ---")
-    
-    # Run migration to add random_val to existing jokes
-    #print("--- Running migration to add random_val to jokes ---")
-    #result = FirebaseService.migrate_add_random_val()
-    #print(f"--- Migration completed: {result} ---")
-except Exception as e:
-    print(f"--- Firebase Failed: {e} ---")
 
 # Create FastAPI app
 app = FastAPI(
@@ -40,6 +35,37 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Include routers
 app.include_router(router, prefix="/api", tags=["api"])
 
+@app.on_event("startup")
+async def startup():
+    # Initialize Firebase and prime the cached Firestore client and Storage bucket
+    try:
+        initialize_firebase()
+        print("--- Firebase Initialized ---")
+        
+        # Run migration to add random_val to existing jokes
+        #print("--- Running migration to add random_val to jokes ---")
+        #result = FirebaseService.migrate_add_random_val()
+        #print(f"--- Migration completed: {result} ---")
+        
+        # Run migration to add joke_punchline_lower (used for duplicate lookups) to existing jokes
+        #print("--- Running migration to add joke_punchline_lower to jokes ---")
+        #result = FirebaseService.migrate_add_punchline_lower()
+        #print(f"--- Migration completed: {result} ---")
+        
+        # Run migration to add filter_keys (used by get_random_jokes filters) to existing jokes
+        #print("--- Running migration to add filter_keys to jokes ---")
+        #result = FirebaseService.migrate_add_filter_keys()
+        #print(f"--- Migration completed: {result} ---")
+    except Exception as e:
+        print(f"--- Firebase Failed: {e} ---")
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Close the shared ElevenLabs HTTP client
+    await ElevenlabsService.aclose()
+    # Commit any batched Firestore writes still waiting in the queue
+    await asyncio.to_thread(FirebaseService.flush_queued_writes)
+
 @app.get("/")
 async def root():
     return {"message": "Joke API is running", "docs": "/docs"}
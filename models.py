@@ -30,6 +30,7 @@ class JokeResponse(BaseModel):
 
 class JokeListResponse(BaseModel):
     jokes: List[JokeResponse]
+    next_cursor: Optional[str] = None  # joke_id to pass as start_after for the next page
 
 class LoginResponse(BaseModel):
     message: str
@@ -1,15 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends, status, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, status, BackgroundTasks, Query
 from pydantic import BaseModel
 from models import JokeCreate, JokeResponse, JokeListResponse, LoginResponse, FavoriteResponse, DeleteJokeResponse, LikeDislikeResponse, GeminiJokeRequest, GeminiJokeResponse, JokeAudioRequest, JokeAudioResponse, VoiceCreate, VoiceResponse, JokeJarRequest, JokeJarResponse, VoiceListResponse, VoiceItem
 from firebase_service import FirebaseService
-from firebase.auth import get_current_user_id, get_optional_user_id
-from firebase_admin import auth
+from firebase.auth import get_current_user_id, get_optional_user_id, verify_id_token_cached
 from gemini_service import GeminiService
 from elevenlabs_service import ElevenlabsService
 from typing import Optional
 from datetime import datetime
+import asyncio
 import random
-import uuid
 import threading
 
 router = APIRouter()
@@ -27,7 +26,7 @@ async def login(request: LoginRequest):
     This endpoint expects a Firebase ID token in the request body
     """
     try:
-        decoded_token = auth.verify_id_token(request.token)
+        decoded_token = verify_id_token_cached(request.token)
         user_id = decoded_token.get('uid')
         # Email is usually present, but may be empty for some Google accounts
         # or if user hasn't verified their email
@@ -66,8 +65,7 @@ async def add_joke(
         )
         
         # Get the created joke to return
-        jokes = FirebaseService.get_all_jokes()
-        created_joke = next((j for j in jokes if j.joke_id == joke_id), None)
+        created_joke = FirebaseService.get_joke_by_id(joke_id)
         
         if not created_joke:
             raise HTTPException(
@@ -83,13 +81,14 @@ async def add_joke(
         )
 
 @router.get("/jokes", response_model=JokeListResponse)
-async def get_all_jokes():
+async def get_all_jokes(limit: int = Query(50, ge=1, le=100), start_after: Optional[str] = None):
     """
-    Get all jokes (no authentication required)
+    Get all jokes, newest first, one page at a time (no authentication required)
+    Pass the returned next_cursor as start_after to get the next page; limit is 1-100
     """
     try:
-        jokes = FirebaseService.get_all_jokes()
-        return JokeListResponse(jokes=jokes)
+        jokes, next_cursor = await FirebaseService.get_all_jokes(limit=limit, start_after=start_after)
+        return JokeListResponse(jokes=jokes, next_cursor=next_cursor)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -114,7 +113,7 @@ async def get_favorite_jokes(
             )
         
         # Get favorite jokes
-        jokes = FirebaseService.get_favorite_jokes(user_id)
+        jokes = await FirebaseService.get_favorite_jokes_async(user_id)
         return JokeListResponse(jokes=jokes)
     except HTTPException:
         raise
@@ -142,7 +141,7 @@ async def get_user_created_jokes(
             )
         
         # Get created jokes
-        jokes = FirebaseService.get_user_created_jokes(user_id)
+        jokes = await FirebaseService.get_user_created_jokes_async(user_id)
         return JokeListResponse(jokes=jokes)
     except HTTPException:
         raise
@@ -320,7 +319,7 @@ async def get_liked_jokes(
             )
 
         # Get liked jokes
-        jokes = FirebaseService.get_liked_jokes(user_id)
+        jokes = await FirebaseService.get_liked_jokes_async(user_id)
         return JokeListResponse(jokes=jokes)
     except HTTPException:
         raise
@@ -348,7 +347,7 @@ async def get_disliked_jokes(
             )
 
         # Get disliked jokes
-        jokes = FirebaseService.get_disliked_jokes(user_id)
+        jokes = await FirebaseService.get_disliked_jokes_async(user_id)
         return JokeListResponse(jokes=jokes)
     except HTTPException:
         raise
@@ -458,9 +457,11 @@ async def generate_jokes_with_gemini(
         
         # If user is authenticated, get their preferences
         if current_user_id:
-            # Get user's liked and disliked jokes for personalization
-            liked_jokes = FirebaseService.get_liked_jokes(current_user_id)
-            disliked_jokes = FirebaseService.get_disliked_jokes(current_user_id)
+            # Get user's liked and disliked jokes for personalization (fetched concurrently)
+            liked_jokes, disliked_jokes = await asyncio.gather(
+                FirebaseService.get_liked_jokes_async(current_user_id),
+                FirebaseService.get_disliked_jokes_async(current_user_id)
+            )
             
             # Convert to dictionaries for Gemini service
             if liked_jokes:
@@ -484,7 +485,7 @@ async def generate_jokes_with_gemini(
                 ]
         
         # Generate jokes using Gemini with user preferences (if available)
-        jokes = GeminiService.generate_jokes(
+        jokes = await GeminiService.generate_jokes_async(
             age_range=request.age_range,
             scenario=request.scenario,
             num_jokes=10,
@@ -533,18 +534,20 @@ async def get_jokes(
                 detail="You can only get jokes for your own account"
             )
         
-        # Get user's disliked, and joke_jar joke IDs
-        user_joke_ids = FirebaseService.get_user_joke_ids(user_id)
-        disliked_joke_ids = user_joke_ids.get('disliked_joke_ids', [])
-        joke_jar_ids = user_joke_ids.get('joke_jar_ids', [])
-        
-        # Get random jokes from database that match age_range and scenario
+        # Get user's disliked and joke_jar joke IDs, and random jokes from database that match
+        # age_range and scenario; the blocking Firestore reads run concurrently in worker threads
         num_jokes = request.num_jokes if request.num_jokes and request.num_jokes > 0 else 5
-        all_jokes = FirebaseService.get_random_jokes(
-            limit=num_jokes * 5,  # Get more to ensure we have enough after filtering
-            age_range=request.age_range,
-            scenario=request.scenario
+        user_joke_ids, all_jokes = await asyncio.gather(
+            asyncio.to_thread(FirebaseService.get_user_joke_ids, user_id),
+            asyncio.to_thread(
+                FirebaseService.get_random_jokes,
+                limit=num_jokes * 5,  # Get more to ensure we have enough after filtering
+                age_range=request.age_range,
+                scenario=request.scenario
+            )
         )
+        disliked_joke_ids = user_joke_ids.get('disliked_joke_ids', [])
+        joke_jar_ids = user_joke_ids.get('joke_jar_ids', [])
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Retrieved {len(all_jokes)} random jokes from database")
         
         # Calculate fresh_jokes = all_jokes - joke_jar jokes
@@ -595,10 +598,12 @@ async def get_jokes(
                 print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Getting {num_jokes} jokes from Gemini for user {user_id}, age_range: {request.age_range}, scenario: {request.scenario}, better to get new jokes which user has not liked or disliked.")
                 
                 # Get random liked and disliked jokes for Gemini context (avoids full database scan)
-                liked_jokes_for_gemini = FirebaseService.get_random_liked_jokes(user_id, limit=10)
-                disliked_jokes_for_gemini = FirebaseService.get_random_disliked_jokes(user_id, limit=10)
+                # Blocking Firestore reads run in a worker thread so they don't stall the event loop
+                liked_jokes_for_gemini, disliked_jokes_for_gemini = await asyncio.to_thread(
+                    FirebaseService.get_random_liked_and_disliked, user_id, liked_limit=10, disliked_limit=10
+                )
                 
-                gemini_jokes = GeminiService.generate_jokes(
+                gemini_jokes = await GeminiService.generate_jokes_async(
                     age_range=request.age_range,
                     scenario=request.scenario,
                     num_jokes=num_jokes,
@@ -620,16 +625,20 @@ async def get_jokes(
                     ] if disliked_jokes_for_gemini else None
                 )
                 
+                # Use the ID of an already stored copy of the joke, otherwise its content ID,
+                # so the returned joke_id always names the document the joke is saved to
+                joke_ids = await asyncio.to_thread(
+                    FirebaseService.resolve_joke_ids,
+                    [(gemini_joke.joke_setup, gemini_joke.joke_punchline) for gemini_joke in gemini_jokes]
+                )
+                
                 # Convert Gemini jokes to JokeResponse format
                 result_jokes = []
                 jokes_to_save = []
-                for gemini_joke in gemini_jokes:
-                    # Generate UUID for joke_id
-                    joke_id = str(uuid.uuid4())
-                    
-                    # Create a temporary JokeResponse with UUID for joke_id
+                for gemini_joke, joke_id in zip(gemini_jokes, joke_ids):
+                    # Create a temporary JokeResponse with the resolved joke_id
                     joke_response = JokeResponse(
-                        joke_id=joke_id,  # Generate UUID for new jokes
+                        joke_id=joke_id,
                         joke_setup=gemini_joke.joke_setup,
                         joke_punchline=gemini_joke.joke_punchline,
                         joke_content=gemini_joke.joke_content,
@@ -646,7 +655,7 @@ async def get_jokes(
                     
                     # Prepare joke data for saving with joke_id
                     jokes_to_save.append({
-                        "joke_id": joke_id,  # Include the UUID so it's used when saving
+                        "joke_id": joke_id,  # Include the resolved ID so it's used when saving
                         "joke_setup": gemini_joke.joke_setup,
                         "joke_punchline": gemini_joke.joke_punchline,
                         "joke_content": gemini_joke.joke_content,
@@ -710,7 +719,7 @@ async def get_audio_for_joke(joke_id: str, background_tasks: BackgroundTasks):
         
         # Generate audio using Gemini TTS (this now handles upload and DB save)
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Start generate audio with Gemini for joke {joke_id}")
-        result = GeminiService.generate_audio_for_joke(joke_id, joke.joke_setup, joke.joke_punchline)
+        result = await GeminiService.generate_audio_for_joke_async(joke_id, joke.joke_setup, joke.joke_punchline)
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Finished generate_audio_with_gemini for joke {joke_id}")
         
         if not result:
@@ -833,7 +842,7 @@ async def get_audio_for_joke_with_voice(joke_id: str, voice_id: str, background_
         # Step 5: Generate audio using ElevenLabs
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Start generating audio with ElevenLabs for joke {joke_id} with voice {voice_id}")
         elevenlabs_service = ElevenlabsService()
-        result = elevenlabs_service.read_joke_with_the_voice(
+        result = await elevenlabs_service.read_joke_with_the_voice(
             firebase_voice_url=voice_url,
             joke_text=joke_text,
             joke_id=joke_id
@@ -924,7 +933,7 @@ async def add_to_history(
             )
         
         # Add joke_id to user's joke_jar
-        success = FirebaseService.add_to_joke_jar(
+        success = FirebaseService.add_to_history(
             creator_id=request.creator_id,
             joke_id=request.joke_id
         )
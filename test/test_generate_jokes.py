@@ -4,6 +4,7 @@ Test script to generate jokes using Gemini and save them to the database.
 Generates 5 jokes with age_range: 5-8, scenario: home.
 """
 
+import asyncio
 import os
 import sys
 import uuid
@@ -44,13 +45,13 @@ def main():
     
     try:
         # Generate jokes using Gemini
-        gemini_jokes = GeminiService.generate_jokes(
+        gemini_jokes = asyncio.run(GeminiService.generate_jokes_async(
             age_range=age_range,
             scenario=scenario,
             num_jokes=num_jokes,
             liked_jokes=None,
             disliked_jokes=None
-        )
+        ))
         
         print(f"✓ Successfully generated {len(gemini_jokes)} joke(s)")
         